@@ -0,0 +1,171 @@
+"""Headless benchmarks for TimeTracker startup and hot paths
+
+Measures, against synthetic histories of different sizes:
+- cold start: a fresh interpreter importing the engine and storage modules
+  (not the Tk window) and loading totals
+- load_projects_and_rates: opening the store and building the totals cache
+- update_project_totals: looking up a project total (cache and store query)
+- search_projects: filtering the project picker by a typed prefix
+- stop_tracking: committing one session to the store and the cache
+- close: what closing the window does after a session was stored: flushing
+  the write-behind queue, bringing the workbook export up to date and
+  closing the store
+
+No display is needed; the Tk-free tracking engine is driven directly.
+
+Usage:
+    python benchmarks/bench_hotpaths.py
+    python benchmarks/bench_hotpaths.py --sizes 1000,100000 --backends sqlite,xlsx --json results.json
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tracker_engine import ProjectSearch, TrackingEngine  # noqa: E402
+from tracker_storage import WriteBehindQueue, refresh_export  # noqa: E402
+from generate_history import generate_sessions, write_history  # noqa: E402
+
+DEFAULT_SIZES = [1000, 100000, 1000000]
+FILE_NAMES = {
+    "sqlite": "time_tracking.db",
+    "xlsx": "time_tracking.xlsx",
+    "parquet": "time_tracking.parquet"
+}
+
+
+def build_history(backend, directory, count, projects):
+    """Create a data file holding count sessions and return its path"""
+    path = os.path.join(directory, FILE_NAMES[backend])
+    write_history(path, generate_sessions(count, projects))
+    return path
+
+
+def timed(func, repeat):
+    """Run func repeat times and return the durations in milliseconds"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def bench_cold_start(path):
+    code = (
+        "import sys; sys.path.insert(0, {root!r})\n"
+        "from tracker_engine import TrackingEngine\n"
+        "engine = TrackingEngine.open({path!r}, '')\n"
+        "engine.projects(); engine.rates()\n"
+    ).format(root=ROOT, path=path)
+    subprocess.run([sys.executable, "-c", code], check=True, cwd=os.path.dirname(path))
+
+
+def bench_load(path):
+    engine = TrackingEngine.open(path, '')
+    engine.projects()
+    engine.rates()
+    engine.store.close()
+
+
+def bench_close(path, excel_file, pending_file):
+    """Store one session through the write-behind queue, then time the close"""
+    engine = TrackingEngine.open(path, excel_file)
+    engine.writer = WriteBehindQueue(engine.store, pending_file)
+    engine.start(engine.projects()[0], engine.rates()[0], 'EUR')
+    engine.commit(engine.stop())
+    start = time.perf_counter()
+    engine.writer.flush()
+    refresh_export(engine.store, excel_file, True)
+    engine.store.close()
+    return (time.perf_counter() - start) * 1000
+
+
+def run(backend, count, projects, repeat, workdir):
+    directory = tempfile.mkdtemp(prefix=f"bench_{backend}_{count}_", dir=workdir)
+    try:
+        start = time.perf_counter()
+        path = build_history(backend, directory, count, projects)
+        print(f"  built {count:,} sessions in {time.perf_counter() - start:.1f}s")
+
+        results = {
+            'cold_start': timed(lambda: bench_cold_start(path), repeat),
+            'load_projects_and_rates': timed(lambda: bench_load(path), repeat),
+        }
+
+        engine = TrackingEngine.open(path, '')
+        project = engine.projects()[0]
+        rate = engine.rates()[0]
+        results['update_project_totals (cache)'] = timed(
+            lambda: engine.amount(project, rate), repeat)
+        results['update_project_totals (store)'] = timed(
+            lambda: engine.store.project_minutes(project), repeat)
+        search = ProjectSearch(engine.projects())
+        results['search_projects'] = timed(lambda: search.search(project[:8]), repeat)
+
+        def stop_tracking():
+            engine.start(project, rate, 'EUR')
+            engine.commit(engine.stop())
+        results['stop_tracking'] = timed(stop_tracking, repeat)
+
+        engine.writer = WriteBehindQueue(engine.store, os.path.join(directory, "pending"))
+        results['stop_tracking (write-behind)'] = timed(stop_tracking, repeat)
+        engine.writer.flush()
+        # The first export writes the whole history; closes after it only
+        # bring the export up to date
+        excel_file = os.path.join(directory, "export.xlsx")
+        refresh_export(engine.store, excel_file)
+        engine.store.close()
+
+        pending_file = os.path.join(directory, "pending")
+        results['close'] = [bench_close(path, excel_file, pending_file) for _ in range(repeat)]
+        return results
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark TimeTracker hot paths")
+    parser.add_argument("--sizes", default=",".join(str(s) for s in DEFAULT_SIZES),
+                        help="comma-separated history sizes (sessions)")
+    parser.add_argument("--backends", default="sqlite",
+                        help="comma-separated backends: sqlite, xlsx, parquet")
+    parser.add_argument("--projects", type=int, default=1000, help="distinct projects in the history")
+    parser.add_argument("--repeat", type=int, default=5, help="samples per measurement")
+    parser.add_argument("--workdir", default=None, help="directory for temporary data files")
+    parser.add_argument("--json", dest="json_file", help="also write results to this file")
+    args = parser.parse_args(argv)
+
+    report = []
+    for backend in args.backends.split(","):
+        for count in [int(s) for s in args.sizes.split(",")]:
+            print(f"{backend} / {count:,} sessions")
+            results = run(backend, count, args.projects, args.repeat, args.workdir)
+            for name, samples in results.items():
+                median = statistics.median(samples)
+                print(f"  {name:32s} median {median:10.3f} ms   min {min(samples):10.3f} ms")
+                report.append({
+                    'backend': backend,
+                    'sessions': count,
+                    'measurement': name,
+                    'median_ms': median,
+                    'min_ms': min(samples),
+                    'samples_ms': samples
+                })
+
+    if args.json_file:
+        with open(args.json_file, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
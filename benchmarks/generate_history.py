@@ -0,0 +1,166 @@
+"""Synthetic session-history generator for load testing
+
+Produces sessions with the time_tracking.xlsx schema (Project, Date,
+Start_Time, End_Time, Duration_Minutes, Rate, Currency, Start_UTC, End_UTC,
+UTC_Offset) at any scale.
+Records are generated lazily in chronological order and streamed to disk,
+so memory use does not depend on the number of sessions.
+
+Project popularity follows a Zipf-like distribution (a few clients get most
+of the hours), session lengths are log-normal, and every project keeps one
+rate and currency, as it would in real use.
+
+Usage:
+    python benchmarks/generate_history.py time_tracking.xlsx --sessions 100000
+    python benchmarks/generate_history.py history.db --sessions 1000000 --projects 5000 --skew 1.2
+"""
+
+import argparse
+import bisect
+import csv
+import itertools
+import os
+import random
+import sys
+from datetime import date, datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tracker_model import with_epochs  # noqa: E402
+from tracker_storage import COLUMNS, ParquetStore, SQLiteStore  # noqa: E402
+
+CURRENCIES = [
+    # (currency, share of projects, typical rates per 8 hours)
+    ("EUR", 0.60, [250.0, 350.0, 400.0, 500.0, 650.0, 800.0]),
+    ("USD", 0.25, [300.0, 400.0, 550.0, 700.0, 900.0]),
+    ("GBP", 0.10, [250.0, 350.0, 450.0, 600.0]),
+    ("JPY", 0.03, [40000.0, 60000.0, 80000.0]),
+    ("CNY", 0.02, [2000.0, 3000.0, 4500.0]),
+]
+
+CHUNK = 10000
+
+
+def make_projects(count, rng):
+    """Return (name, rate, currency) for count projects"""
+    currency_weights = list(itertools.accumulate(c[1] for c in CURRENCIES))
+    projects = []
+    for i in range(count):
+        currency, _, rates = CURRENCIES[bisect.bisect(currency_weights, rng.random() * currency_weights[-1])]
+        projects.append((f"Client {i // 3:04d} - Project {i:05d}", rng.choice(rates), currency))
+    return projects
+
+
+def generate_sessions(sessions, projects=1000, skew=1.1, start=None, days=3 * 365, seed=0):
+    """Yield session records in chronological order"""
+    rng = random.Random(seed)
+    catalog = make_projects(projects, rng)
+    # Zipf-like popularity: project i is picked with weight 1 / (i + 1) ** skew
+    cum_weights = list(itertools.accumulate(1.0 / (i + 1) ** skew for i in range(projects)))
+    total_weight = cum_weights[-1]
+
+    if start is None:
+        start = date.today() - timedelta(days=days)
+    workdays = [start + timedelta(days=d) for d in range(days)
+                if (start + timedelta(days=d)).weekday() < 5]
+    if not workdays:
+        workdays = [start]
+
+    produced = 0
+    for index, day in enumerate(workdays):
+        # Spread the sessions evenly over the working days
+        target = (index + 1) * sessions // len(workdays)
+        starts = sorted(rng.randrange(7 * 3600, 20 * 3600) for _ in range(target - produced))
+        for start_seconds in starts:
+            name, rate, currency = catalog[bisect.bisect(cum_weights, rng.random() * total_weight)]
+            minutes = max(1, min(600, int(rng.lognormvariate(3.8, 0.8))))
+            # Late sessions run past midnight, ending the next day like real ones
+            end_seconds = (start_seconds + minutes * 60) % (24 * 3600)
+            yield with_epochs({
+                'Project': name,
+                'Date': day.isoformat(),
+                'Start_Time': format_seconds(start_seconds),
+                'End_Time': format_seconds(end_seconds),
+                'Duration_Minutes': minutes,
+                'Rate': rate,
+                'Currency': currency
+            })
+        produced = target
+
+
+def parse_date(text):
+    return datetime.strptime(text, "%Y-%m-%d").date()
+
+
+def format_seconds(seconds):
+    return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+def write_xlsx(path, records):
+    """Stream records into a workbook using openpyxl's write-only mode"""
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Sheet1")
+    sheet.append(COLUMNS)
+    for record in records:
+        row = [record[c] for c in COLUMNS]
+        row[1] = parse_date(record['Date'])
+        sheet.append(row)
+    workbook.save(path)
+
+
+def write_csv(path, records):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS)
+        writer.writeheader()
+        writer.writerows(records)
+
+
+def write_store(store, records):
+    """Add records to a store in chunks"""
+    while True:
+        chunk = list(itertools.islice(records, CHUNK))
+        if not chunk:
+            break
+        store.add_sessions(chunk)
+    store.close()
+
+
+def write_history(path, records):
+    """Write records to path in the format given by its extension"""
+    records = iter(records)
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".xlsx":
+        write_xlsx(path, records)
+    elif extension == ".csv":
+        write_csv(path, records)
+    elif extension in (".db", ".sqlite"):
+        write_store(SQLiteStore(path), records)
+    elif extension == ".parquet":
+        write_store(ParquetStore(path), records)
+    else:
+        raise ValueError(f"Unsupported output format: {extension}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic TimeTracker history")
+    parser.add_argument("output", help="output file (.xlsx, .csv, .db, .sqlite or .parquet)")
+    parser.add_argument("--sessions", type=int, default=100000, help="number of sessions")
+    parser.add_argument("--projects", type=int, default=1000, help="number of distinct projects")
+    parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent of project popularity")
+    parser.add_argument("--start", type=parse_date, default=None,
+                        help="first day of the history (YYYY-MM-DD)")
+    parser.add_argument("--days", type=int, default=3 * 365, help="length of the history in days")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    args = parser.parse_args(argv)
+
+    if os.path.exists(args.output):
+        parser.error(f"{args.output} already exists")
+    write_history(args.output, generate_sessions(
+        args.sessions, args.projects, args.skew, args.start, args.days, args.seed))
+    print(f"Wrote {args.sessions:,} sessions to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
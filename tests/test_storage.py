@@ -0,0 +1,249 @@
+"""Tests for workbooks, journals, exports and write-behind replays
+
+Run with: python -m pytest tests
+"""
+
+import os
+import re
+import shutil
+import sys
+import tempfile
+import unittest
+import zipfile
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tracker_model import with_epochs  # noqa: E402
+from tracker_storage import (  # noqa: E402
+    COLUMNS, ExcelStore, SessionJournal, SQLiteStore, WriteBehindQueue,
+    append_workbook, iter_workbook, open_store, refresh_export, write_workbook
+)
+
+OLD_COLUMNS = COLUMNS[:7]
+
+
+def session(project, day, start_time, end_time, minutes, rate=50.0, currency="EUR"):
+    return with_epochs({
+        'Project': project,
+        'Date': day,
+        'Start_Time': start_time,
+        'End_Time': end_time,
+        'Duration_Minutes': minutes,
+        'Rate': rate,
+        'Currency': currency
+    })
+
+
+SESSIONS = [
+    session("Alpha", "2024-01-08", "09:00:00", "10:30:00", 90),
+    session("Beta", "2024-01-08", "11:00:00", "11:45:00", 45, 80.0, "USD"),
+    session("Alpha", "2024-01-09", "23:30:00", "00:15:00", 45),
+]
+
+
+def read_records(excel_file):
+    return [record for chunk in iter_workbook(excel_file) for record in chunk]
+
+
+class TempDirTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="tracker_test_")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+
+class AppendWorkbookTest(TempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.excel_file = self.path("sessions.xlsx")
+        write_workbook(self.excel_file, [SESSIONS[:2]])
+
+    def shared_strings(self):
+        with zipfile.ZipFile(self.excel_file) as archive:
+            table = ET.fromstring(archive.read("xl/sharedStrings.xml"))
+            sheet = archive.read("xl/worksheets/sheet1.xml")
+        return table, len(re.findall(rb'<c [^>]*\bt="s"', sheet))
+
+    def test_appended_workbook_opens_in_openpyxl_and_pandas(self):
+        import openpyxl
+        import pandas as pd
+        append_workbook(self.excel_file, SESSIONS[2:])
+
+        workbook = openpyxl.load_workbook(self.excel_file, read_only=True)
+        rows = list(workbook.worksheets[0].iter_rows(values_only=True))
+        workbook.close()
+        self.assertEqual(list(rows[0]), COLUMNS)
+        self.assertEqual([row[0] for row in rows[1:]], ["Alpha", "Beta", "Alpha"])
+        self.assertEqual(rows[3][3], "00:15:00")
+
+        df = pd.read_excel(self.excel_file)
+        self.assertEqual(list(df.columns), COLUMNS)
+        self.assertEqual(df['Project'].tolist(), ["Alpha", "Beta", "Alpha"])
+        self.assertEqual(df['Duration_Minutes'].tolist(), [90, 45, 45])
+        self.assertEqual(df['Start_UTC'].tolist(), [r['Start_UTC'] for r in SESSIONS])
+
+        self.assertEqual(read_records(self.excel_file), SESSIONS)
+
+    def test_shared_string_counts_follow_appends(self):
+        append_workbook(self.excel_file, SESSIONS[2:])
+        table, cells = self.shared_strings()
+        texts = [item.findtext("{*}t") for item in table]
+        self.assertEqual(sorted(texts), ["Alpha", "EUR"])
+        self.assertEqual(int(table.get("uniqueCount")), len(texts))
+        self.assertEqual(int(table.get("count")), cells)
+
+        # A second append reuses the strings and adds the new ones
+        append_workbook(self.excel_file, [session("Gamma", "2024-01-10", "08:00:00", "09:00:00", 60)])
+        table, cells = self.shared_strings()
+        texts = [item.findtext("{*}t") for item in table]
+        self.assertEqual(sorted(texts), ["Alpha", "EUR", "Gamma"])
+        self.assertEqual(int(table.get("uniqueCount")), 3)
+        self.assertEqual(int(table.get("count")), cells)
+        self.assertEqual(len(read_records(self.excel_file)), 4)
+
+    def test_new_strings_follow_duplicate_entries(self):
+        append_workbook(self.excel_file, SESSIONS[2:])
+        # Excel can keep the same text twice, e.g. as a rich-text variant
+        with zipfile.ZipFile(self.excel_file) as source:
+            members = [(info, source.read(info)) for info in source.infolist()]
+        with zipfile.ZipFile(self.excel_file, "w", zipfile.ZIP_DEFLATED) as target:
+            for info, data in members:
+                if info.filename == "xl/sharedStrings.xml":
+                    data = data.replace(b"</sst>", b"<si><r><t>Al</t></r><r><t>pha</t></r></si></sst>")
+                    data = re.sub(rb'uniqueCount="\d+"', b'uniqueCount="3"', data)
+                target.writestr(info, data)
+
+        append_workbook(self.excel_file, [session("Zeta", "2024-01-10", "08:00:00", "09:00:00", 60,
+                                                  currency="GBP")])
+        last = read_records(self.excel_file)[-1]
+        self.assertEqual((last['Project'], last['Currency']), ("Zeta", "GBP"))
+        self.assertEqual(read_records(self.excel_file)[:3], SESSIONS)
+
+    def test_flush_rewrites_workbook_without_data_row(self):
+        import openpyxl
+        workbook = openpyxl.Workbook()
+        workbook.active.append(OLD_COLUMNS)
+        workbook.save(self.excel_file)
+        with self.assertRaises(ValueError):
+            append_workbook(self.excel_file, SESSIONS[:1])
+
+        store = ExcelStore(self.excel_file)
+        store.add_sessions(SESSIONS)
+        self.assertEqual(store.flush(), 3)
+        self.assertEqual(read_records(self.excel_file), SESSIONS)
+        self.assertEqual(os.path.getsize(store.journal.path), 0)
+
+
+class ReadWorkbookTest(TempDirTestCase):
+
+    def write_rows(self, rows, iso_dates=False):
+        import openpyxl
+        excel_file = self.path("sessions.xlsx")
+        workbook = openpyxl.Workbook()
+        workbook.iso_dates = iso_dates
+        workbook.active.append(OLD_COLUMNS)
+        for row in rows:
+            workbook.active.append(row)
+        workbook.save(excel_file)
+        return excel_file
+
+    def test_iso_date_cells(self):
+        from datetime import date, time
+        excel_file = self.write_rows([["Alpha", date(2024, 1, 8), time(9, 0), time(10, 30), 90, 50.0, "EUR"]],
+                                     iso_dates=True)
+        self.assertEqual(read_records(excel_file), SESSIONS[:1])
+
+    def test_incomplete_rows_are_skipped_but_stop_an_import(self):
+        excel_file = self.write_rows([
+            [r[c] for c in OLD_COLUMNS] for r in SESSIONS[:2]
+        ] + [["Gamma", "2024-01-10", "08:00:00", None, 60, 50.0, "EUR"],
+             ["Delta", "2024-01-10", "08:00:00", "09:00:00", "sixty", 50.0, "EUR"]])
+        self.assertEqual(read_records(excel_file), SESSIONS[:2])
+
+        db_file = self.path("time_tracking.db")
+        with self.assertRaises(ValueError):
+            open_store(db_file, excel_file)
+        # Nothing half-imported is left, and the workbook is untouched
+        self.assertFalse(os.path.exists(db_file))
+        self.assertEqual(len(read_records(excel_file)), 2)
+
+
+class ExportTest(TempDirTestCase):
+
+    def test_import_keeps_original_and_never_overwrites_edits(self):
+        excel_file = self.path("time_tracking.xlsx")
+        write_workbook(excel_file, [SESSIONS[:2]])
+        with open(excel_file, "rb") as f:
+            original = f.read()
+
+        store = open_store(self.path("time_tracking.db"), excel_file)
+        self.assertFalse(os.path.exists(excel_file))
+        with open(self.path("time_tracking.bak.xlsx"), "rb") as f:
+            self.assertEqual(f.read(), original)
+
+        refresh_export(store, excel_file)
+        store.add_sessions(SESSIONS[2:])
+        self.assertEqual(store.update_export(excel_file), 1)
+        self.assertEqual(read_records(excel_file), SESSIONS)
+
+        # A hand-edited export is left alone
+        stat = os.stat(excel_file)
+        os.utime(excel_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        store.add_sessions(SESSIONS[:1])
+        with self.assertRaises(ValueError):
+            refresh_export(store, excel_file)
+        self.assertEqual(read_records(excel_file), SESSIONS)
+        store.close()
+
+
+class SessionJournalTest(TempDirTestCase):
+
+    def test_records_after_a_torn_line_are_kept(self):
+        journal = SessionJournal(self.path("sessions.journal"))
+        journal.append({'a': 1})
+        # A crash part way through writing the second record
+        with open(journal.path, "a", encoding="utf-8") as f:
+            f.write('{"a": 2, "b"')
+        journal.append({'a': 3})
+        journal.extend([{'a': 4}])
+        self.assertEqual(journal.read(), [{'a': 1}, {'a': 3}, {'a': 4}])
+
+    def test_bad_lines_do_not_hide_later_records(self):
+        journal = SessionJournal(self.path("sessions.journal"))
+        with open(journal.path, "w", encoding="utf-8") as f:
+            f.write('{"a": 1}\n{"a": 2, "b\n{"a": 3}\n')
+        self.assertEqual(journal.read(), [{'a': 1}, {'a': 3}])
+
+
+class WriteBehindReplayTest(TempDirTestCase):
+
+    def test_interrupted_flush_is_replayed_once(self):
+        store = SQLiteStore(self.path("sessions.db"))
+        pending_file = self.path("sessions.pending")
+        journal = SessionJournal(pending_file)
+        # A flush that stored its batch and then crashed before clearing the
+        # journal, followed by one that crashed before the store write
+        for record in SESSIONS[:2]:
+            journal.append({'queued': 0, 'record': record})
+        journal.append({'batch': "stored"})
+        store.add_sessions(SESSIONS[:2], "stored")
+        journal.append({'queued': 0, 'record': SESSIONS[2]})
+        journal.append({'batch': "lost"})
+
+        queue = WriteBehindQueue(store, pending_file)
+        self.assertEqual(queue.flush(), 1)
+        self.assertEqual(queue.flush(), 0)
+        self.assertEqual(store.sessions(sort='Date', descending=False), SESSIONS)
+        self.assertTrue(store.has_batch("lost"))
+        store.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,45 +1,364 @@
 # TimeTracker V.1.2.2 by Frankie De Leonardis - Sin detección de inactividad
 
-import subprocess
+import os
 import sys
+
+if __name__ == "__main__" and len(sys.argv) > 1:
+    # Subcommands (start, stop, status, totals, report) run without a window,
+    # so they are handed over before Tk and the GUI modules are imported
+    from tracker_cli import main
+    sys.exit(main())
+
 import tkinter as tk
-from tkinter import ttk, messagebox, simpledialog
-import pandas as pd
+from tkinter import ttk, messagebox, simpledialog, filedialog
 from datetime import datetime, timedelta
-import os
+import queue
+import threading
+import time
+# pandas/openpyxl are imported by tracker_storage only when a workbook is
+# written (workbooks are read without them), and are installed by the
+# launcher scripts, not at runtime
+from tracker_storage import (
+    open_store, refresh_export, ProjectIndex, SessionCheckpoint, WriteBehindQueue,
+    DEFAULT_DATA_FILE, DEFAULT_EXCEL_FILE, WRITE_BEHIND_MAX_DELAY
+)
+from tracker_engine import (
+    TrackingEngine, ProjectSearch, CURRENCIES, checkpoint_record, format_amount, format_duration,
+    rate_per_minute, session_clock
+)
+
+# Seconds between checkpoint refreshes of the running session
+CHECKPOINT_INTERVAL = 30
+
+# Seconds between timer updates while the window is minimized
+MINIMIZED_TIMER_INTERVAL = 5
+# Ticks are scheduled this many milliseconds after a second boundary, so
+# that Tk's timer granularity never lands them just before it
+TIMER_SLACK_MS = 5
+
+class IOWorker:
+    """Runs storage work on a dedicated thread and hands results back to Tk"""
+
+    def __init__(self, root, poll_ms=50):
+        self.root = root
+        self.poll_ms = poll_ms
+        self.tasks = queue.Queue()
+        self.results = queue.Queue()
+        self.stopped = False
+        # Tasks run one at a time in submission order, so a save queued
+        # right after the store is opened always sees the open store
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        self.root.after(self.poll_ms, self._poll)
+
+    def submit(self, func, on_done=None, on_error=None):
+        """Queue func for the worker; callbacks run later on the Tk thread"""
+        self.tasks.put((func, on_done, on_error))
+
+    def stop(self):
+        self.stopped = True
+        self.tasks.put(None)
+
+    def _run(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                break
+            func, on_done, on_error = task
+            try:
+                result = func()
+            except Exception as e:
+                self.results.put((on_error, e, True))
+            else:
+                self.results.put((on_done, result, False))
+
+    def _poll(self):
+        """Deliver finished results via the Tk event loop"""
+        try:
+            while not self.stopped:
+                try:
+                    callback, value, failed = self.results.get_nowait()
+                except queue.Empty:
+                    break
+                if callback is not None:
+                    callback(value)
+                elif failed:
+                    print(f"Error in background task: {str(value)}")
+        finally:
+            # Keep polling even if a callback raised
+            if not self.stopped:
+                self.root.after(self.poll_ms, self._poll)
 
-# Check and install required libraries
-def install_and_import(package):
-    try:
-        __import__(package)
-    except ImportError:
-        subprocess.check_call([sys.executable, "-m", "pip", "install", package])
+class HistoryWindow:
+    """Browse the session history a screenful at a time
+
+    The tree only ever holds the visible rows. Rows are fetched from the store
+    on the I/O worker in blocks, with filtering and sorting done by the store,
+    and the scrollbar is driven by hand over the full result count.
+    """
+
+    VISIBLE_ROWS = 25
+    BLOCK_ROWS = 200
+    # Blocks kept in memory around the visible rows
+    MAX_BLOCKS = 10
+    HEADINGS = {
+        'Date': "Date",
+        'Start_Time': "Start",
+        'End_Time': "End",
+        'Project': "Project",
+        'Duration_Minutes': "Minutes",
+        'Rate': "Rate",
+        'Currency': "Currency"
+    }
+
+    def __init__(self, app):
+        self.app = app
+        self.window = tk.Toplevel(app.root)
+        self.window.title("Session History")
+        self.window.geometry("820x640")
+
+        self.sort = 'Date'
+        self.descending = True
+        self.filters = {}
+        # Filters and order of the rows being shown, as passed to the store
+        self.query = {}
+        self.total = 0
+        self.offset = 0
+        self.blocks = {}
+        self.requested = set()
+        self.wanted = frozenset()
+        # Bumped on every new query so late results of an old one are dropped
+        self.generation = 0
+
+        container = ttk.Frame(self.window, padding="10 10 10 10")
+        container.pack(fill=tk.BOTH, expand=True)
+
+        filters = ttk.Frame(container)
+        filters.pack(fill=tk.X, pady=(0, 10))
+        self.project_var = tk.StringVar()
+        self.from_var = tk.StringVar()
+        self.to_var = tk.StringVar()
+        for label, var, width in [("Project", self.project_var, 30),
+                                  ("From (YYYY-MM-DD)", self.from_var, 12),
+                                  ("To", self.to_var, 12)]:
+            ttk.Label(filters, text=label, style='Section.TLabel').pack(side=tk.LEFT, padx=(0, 5))
+            entry = ttk.Entry(filters, textvariable=var, width=width)
+            entry.pack(side=tk.LEFT, padx=(0, 10))
+            entry.bind('<Return>', self.apply_filters)
+        ttk.Button(filters, text="Filter", command=self.apply_filters).pack(side=tk.LEFT)
+        ttk.Button(filters, text="Clear", command=self.clear_filters).pack(side=tk.LEFT, padx=(5, 0))
+        ttk.Button(filters, text="Billing report", command=self.billing_report).pack(side=tk.RIGHT)
+
+        table = ttk.Frame(container)
+        table.pack(fill=tk.BOTH, expand=True)
+        self.tree = ttk.Treeview(table, columns=list(self.HEADINGS), show="headings",
+                                 height=self.VISIBLE_ROWS, selectmode="browse")
+        for column, heading in self.HEADINGS.items():
+            self.tree.heading(column, text=heading, command=lambda c=column: self.sort_by(c))
+            self.tree.column(column, width=260 if column == 'Project' else 80,
+                             anchor=tk.W if column == 'Project' else tk.CENTER)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.scrollbar = ttk.Scrollbar(table, orient=tk.VERTICAL, command=self.on_scroll)
+        self.scrollbar.pack(side=tk.LEFT, fill=tk.Y)
+
+        self.status_label = ttk.Label(container, text="Loading...", style='Section.TLabel')
+        self.status_label.pack(anchor=tk.W, pady=(10, 0))
+
+        for sequence, rows in [('<Button-4>', -3), ('<Button-5>', 3),
+                               ('<Prior>', -self.VISIBLE_ROWS), ('<Next>', self.VISIBLE_ROWS)]:
+            self.tree.bind(sequence, lambda event, rows=rows: self.scroll_to(self.offset + rows))
+        self.tree.bind('<MouseWheel>', self.on_mousewheel)
+        self.tree.bind('<Home>', lambda event: self.scroll_to(0))
+        self.tree.bind('<End>', lambda event: self.scroll_to(self.total))
+
+        self.reload()
+
+    def reload(self):
+        """Count the matching sessions and show the first screenful"""
+        self.generation += 1
+        self.blocks = {}
+        self.requested = set()
+        self.wanted = frozenset()
+        self.offset = 0
+        self.query = dict(self.filters, sort=self.sort, descending=self.descending)
+        generation = self.generation
+        filters = dict(self.filters)
+        engine = self.app.engine
+
+        def count():
+            # Sessions still waiting in the write-behind queue are listed too
+            if engine.writer is not None:
+                engine.writer.flush()
+            return engine.store.count_sessions(**filters)
+
+        self.status_label.config(text="Loading...")
+        self.app.io.submit(count, lambda total: self.on_count(generation, total), self.on_error)
+
+    def on_count(self, generation, total):
+        if generation != self.generation:
+            return
+        self.total = total
+        self.show()
 
-install_and_import("pandas")
-install_and_import("openpyxl")
+    def on_error(self, error):
+        messagebox.showerror("Error", f"Error reading session history: {str(error)}", parent=self.window)
+
+    def fetch(self, generation, query, block):
+        """Read one block of rows (runs on the I/O worker)"""
+        if generation != self.generation or block not in self.wanted:
+            # Scrolled past before the worker got here
+            return None
+        return self.app.engine.store.sessions(
+            offset=block * self.BLOCK_ROWS, limit=self.BLOCK_ROWS, **query)
+
+    def on_block(self, generation, block, rows):
+        if generation != self.generation:
+            return
+        self.requested.discard(block)
+        if rows is not None:
+            self.blocks[block] = rows
+            self.show()
+
+    def show(self):
+        """Fill the tree with the visible rows, fetching blocks that are missing"""
+        if not self.window.winfo_exists():
+            return
+        end = min(self.offset + self.VISIBLE_ROWS, self.total)
+        first, last = self.offset // self.BLOCK_ROWS, max(end - 1, 0) // self.BLOCK_ROWS
+        needed = set(range(first, last + 1))
+        self.wanted = frozenset(needed)
+        generation, query = self.generation, self.query
+        for block in needed - set(self.blocks) - self.requested:
+            self.requested.add(block)
+            self.app.io.submit(lambda b=block: self.fetch(generation, query, b),
+                               lambda rows, b=block: self.on_block(generation, b, rows),
+                               self.on_error)
+        # Drop the blocks furthest from the view
+        for block in sorted(self.blocks, key=lambda b: abs(b - first))[self.MAX_BLOCKS:]:
+            del self.blocks[block]
+
+        self.tree.delete(*self.tree.get_children())
+        for index in range(self.offset, end):
+            rows = self.blocks.get(index // self.BLOCK_ROWS)
+            if rows is None or index % self.BLOCK_ROWS >= len(rows):
+                break
+            record = rows[index % self.BLOCK_ROWS]
+            self.tree.insert("", tk.END, values=[record[c] for c in self.HEADINGS])
+
+        if self.total:
+            self.scrollbar.set(self.offset / self.total, end / self.total)
+            self.status_label.config(text=f"Sessions {self.offset + 1:,}-{end:,} of {self.total:,}")
+        else:
+            self.scrollbar.set(0, 1)
+            self.status_label.config(text="No sessions")
+
+    def scroll_to(self, offset):
+        offset = max(0, min(int(offset), self.total - self.VISIBLE_ROWS))
+        if offset != self.offset:
+            self.offset = offset
+            self.show()
+        return "break"
+
+    def on_scroll(self, action, amount, unit=None):
+        if action == "moveto":
+            self.scroll_to(float(amount) * self.total)
+        elif unit == "pages":
+            self.scroll_to(self.offset + int(amount) * self.VISIBLE_ROWS)
+        else:
+            self.scroll_to(self.offset + int(amount))
+
+    def on_mousewheel(self, event):
+        return self.scroll_to(self.offset - 3 * (1 if event.delta > 0 else -1))
+
+    def sort_by(self, column):
+        """Sort on a column; a second click reverses the order"""
+        if self.sort == column:
+            self.descending = not self.descending
+        else:
+            self.sort = column
+            self.descending = column in ('Date', 'Duration_Minutes', 'Rate')
+        self.reload()
+
+    def apply_filters(self, event=None):
+        filters = {}
+        if self.project_var.get().strip():
+            filters['project'] = self.project_var.get().strip()
+        for key, var in [('date_from', self.from_var), ('date_to', self.to_var)]:
+            text = var.get().strip()
+            if not text:
+                continue
+            try:
+                datetime.strptime(text, "%Y-%m-%d")
+            except ValueError:
+                messagebox.showwarning("Warning", "Dates must be written as YYYY-MM-DD.",
+                                       parent=self.window)
+                return
+            filters[key] = text
+        self.filters = filters
+        self.reload()
+
+    def billing_report(self):
+        """Save monthly totals per project, rate and currency for the filtered sessions"""
+        path = filedialog.asksaveasfilename(
+            parent=self.window, title="Save billing report", defaultextension=".xlsx",
+            filetypes=[("Excel workbook", "*.xlsx"), ("CSV file", "*.csv")])
+        if not path:
+            return
+        filters = dict(self.filters)
+        engine = self.app.engine
+
+        def write():
+            # pandas is only needed from here on
+            from tracker_report import store_report, write_report
+            if engine.writer is not None:
+                engine.writer.flush()
+            write_report(store_report(engine.store, 'month', **filters), path)
+
+        self.app.io.submit(
+            write,
+            lambda result: messagebox.showinfo("Success", f"Billing report saved to {path}",
+                                               parent=self.window),
+            self.on_error)
+
+    def clear_filters(self):
+        for var in (self.project_var, self.from_var, self.to_var):
+            var.set("")
+        self.apply_filters()
 
 class TimeTrackerApp:
     def __init__(self, root):
         self.root = root
         self.root.title("Time Tracker v1.2.2")
-        self.root.geometry("400x650")
+        self.root.geometry("400x700")
         self.root.configure(bg="#F0F0F0")
 
         # Currency configuration
-        self.currencies = {
-            "EUR": "€",
-            "USD": "$",
-            "GBP": "£",
-            "JPY": "¥",
-            "CNY": "元"
-        }
+        self.currencies = dict(CURRENCIES)
         self.currency_symbol = "€"  # Default currency
 
-        self.current_project = None
-        self.current_rate = None
-        self.start_time = None
-        self.is_tracking = False
-        self.excel_file = "time_tracking.xlsx"
+        self.excel_file = DEFAULT_EXCEL_FILE
+        # Whether this window stored sessions, so the workbook export is stale
+        self.sessions_saved = False
+        # Session state and totals; the engine's store is attached and only
+        # ever touched from the I/O worker thread
+        self.engine = TrackingEngine()
+        # Projects and rates for the dropdowns, readable before the store is open
+        self.engine.index = ProjectIndex()
+        # Every known project; the dropdown only lists the best matches
+        self.project_search = ProjectSearch()
+        # Running session on disk, so a crash does not lose the time tracked
+        self.checkpoint = SessionCheckpoint()
+        self.last_checkpoint = None
+        # Start of the last interrupted session offered for recovery, so it
+        # is offered once
+        self.recovered_start = None
+        self.closing = False
+        self.history = None
+
+        # Timer scheduling state, see update_timer
+        self.timer_job = None
+        self.timer_text = None
+        self.timer_anchor = None
         
         # Initialize total time and rate per minute
         self.total_time = timedelta()
@@ -52,22 +371,14 @@ class TimeTrackerApp:
         self.style.configure('Timer.TLabel', font=('Helvetica', 32, 'bold'))
         self.style.configure('Amount.TLabel', font=('Helvetica', 24, 'bold'))
         
-        # Create Excel file if it doesn't exist
-        if not os.path.exists(self.excel_file):
-            # Create initial DataFrame with explicit dtypes
-            df = pd.DataFrame({
-                'Project': pd.Series(dtype='string'),
-                'Date': pd.Series(dtype='datetime64[ns]'),
-                'Start_Time': pd.Series(dtype='string'),
-                'End_Time': pd.Series(dtype='string'),
-                'Duration_Minutes': pd.Series(dtype='int64'),
-                'Rate': pd.Series(dtype='float64'),
-                'Currency': pd.Series(dtype='string')
-            })
-            df.to_excel(self.excel_file, index=False)
-        
         self.setup_ui()
-        self.load_projects_and_rates()
+        self.fill_projects_and_rates(self.engine.index.load())
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.root.bind("<Map>", self.on_restore)
+
+        # Open the store in the background; the window is usable meanwhile
+        self.io = IOWorker(self.root)
+        self.io.submit(self.open_store, self.on_store_ready, self.on_store_error)
     
     def setup_ui(self):
         # Main container with padding
@@ -114,10 +425,12 @@ class TimeTrackerApp:
         self.project_combo = ttk.Combobox(
             project_controls,
             textvariable=self.project_var,
-            state="readonly",
             font=('Helvetica', 14)
         )
         self.project_combo.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        # Typing filters the dropdown; Return picks the best match
+        self.project_combo.bind('<KeyRelease>', self.filter_projects)
+        self.project_combo.bind('<Return>', self.pick_project)
         
         self.add_project_button = ttk.Button(
             project_controls,
@@ -212,6 +525,14 @@ class TimeTrackerApp:
         )
         self.bill_label.pack(anchor=tk.W)
 
+        self.history_button = ttk.Button(
+            main_container,
+            text="Session history",
+            command=self.open_history,
+            state="disabled"
+        )
+        self.history_button.pack(anchor=tk.W, pady=(20, 0))
+
         # Add bindings for project and rate selection
         self.project_combo.bind('<<ComboboxSelected>>', self.on_project_or_rate_change)
         self.rate_combo.bind('<<ComboboxSelected>>', self.on_project_or_rate_change)
@@ -224,35 +545,175 @@ class TimeTrackerApp:
 
     def format_timer(self, td):
         """Format timedelta to show only two digits for seconds"""
-        hours = int(td.total_seconds() // 3600)
-        minutes = int((td.total_seconds() % 3600) // 60)
-        seconds = int(td.total_seconds() % 60)
-        return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+        return format_duration(td)
     
     def format_amount(self, amount):
         """Format amount with currency symbol"""
-        currency = self.currency_var.get()
-        if currency in ["CNY", "JPY"]:  # No decimal places for these currencies
-            return f"{int(amount):,} {self.currency_symbol}"
+        return format_amount(amount, self.currency_var.get())
+
+    def open_store(self):
+        """Open the store and aggregate totals (runs on the I/O worker)"""
+        # An existing workbook is imported on first run
+        self.engine.store = open_store(DEFAULT_DATA_FILE, self.excel_file)
+        # Sessions are committed through a write-behind queue; store whatever
+        # the CLI or a crashed run left in it before aggregating totals
+        self.engine.writer = WriteBehindQueue(self.engine.store)
+        self.engine.writer.flush()
+        totals = self.engine.load_totals()
+        # Sessions saved before the index existed
+        self.engine.index.add_totals(totals)
+        index = self.engine.index.load()
+        search = ProjectSearch(set(totals.projects()) | set(index['projects']), index['recent'])
+        return totals, self.checkpoint.load(), search
+
+    def on_store_ready(self, result):
+        totals, interrupted, search = result
+        self.engine.totals = totals
+        self.history_button.config(state="normal")
+        # Keep projects added with "+" while the store was opening
+        for project in set(self.project_search.words) - set(search.words):
+            search.touch(project, self.project_search.recent.get(project))
+        self.project_search = search
+        self.load_projects_and_rates()
+        self.schedule_flush()
+        # START may have been pressed while the store was opening; the
+        # checkpoint it found then was offered already
+        if (interrupted is not None and interrupted['owner'] != os.getpid()
+                and interrupted['start'] != self.recovered_start
+                and not self.checkpoint.held_elsewhere(interrupted)):
+            self.recover_session(interrupted)
+
+    def recover_session(self, state):
+        """Offer to resume or save a session left running by a crash or the CLI"""
+        self.recovered_start = state['start']
+        started = datetime.fromtimestamp(state['start'])
+        last_seen = datetime.fromtimestamp(state['last_seen'])
+        if self.engine.is_tracking:
+            # Its checkpoint has made way for the running session's
+            if messagebox.askyesno(
+                    "Unfinished session",
+                    f"A session for {state['project']} started {started:%Y-%m-%d %H:%M} "
+                    f"was not finished.\n\n"
+                    f"Save it ending at {last_seen:%Y-%m-%d %H:%M}? (No discards it)"):
+                self.save_session_async(checkpoint_record(state))
+            return
+        answer = messagebox.askyesnocancel(
+            "Unfinished session",
+            f"A session for {state['project']} started {started:%Y-%m-%d %H:%M} is still open.\n\n"
+            f"Yes: continue timing it\n"
+            f"No: save it ending at {last_seen:%Y-%m-%d %H:%M}\n"
+            f"Cancel: discard it"
+        )
+        if answer is None:
+            self.io.submit(lambda: self.discard_session(state))
+        elif answer:
+            self.engine.restore(state)
+            self.project_var.set(state['project'])
+            self.rate_var.set(state['rate'])
+            self.currency_var.set(state['currency'])
+            self.on_currency_change()
+            # The checkpoint now names this window as the owner
+            self.write_checkpoint()
+            self.show_tracking(True)
+            self.start_timer()
         else:
-            return f"{amount:,.2f} {self.currency_symbol}"
+            self.save_session_async(checkpoint_record(state), state)
+
+    def schedule_flush(self):
+        """Periodically write queued sessions to the store"""
+        if self.closing:
+            return
+        self.io.submit(self.engine.writer.flush_if_due)
+        self.root.after(int(WRITE_BEHIND_MAX_DELAY * 1000), self.schedule_flush)
+
+    def save_session(self, record, state=None):
+        """Store a finished session and clear its checkpoint (runs on the I/O worker)
+
+        state is the checkpoint the session was timed under. If the checkpoint
+        no longer describes it, another process stopped or saved the session:
+        it is not stored again and False is returned. Without state the
+        session is stored and the checkpoint left alone.
+        """
+        if state is not None and not self.checkpoint.describes(state):
+            return False
+        self.engine.save(record)
+        if state is not None:
+            self.checkpoint.clear()
+        return True
+
+    def save_session_async(self, record, state=None):
+        # Totals update once the write succeeded
+        self.io.submit(
+            lambda: self.save_session(record, state),
+            lambda saved: self.on_session_saved(record) if saved else self.on_session_taken(record),
+            lambda error: self.on_session_error(record, error)
+        )
+
+    def discard_session(self, state):
+        """Clear an interrupted session's checkpoint unless it was taken over (runs on the I/O worker)"""
+        if self.checkpoint.describes(state):
+            self.checkpoint.clear()
+
+    def checkpoint_state(self):
+        """Checkpoint state of the running session, owned by this window"""
+        state = self.engine.snapshot()
+        if state is not None:
+            state['owner'] = os.getpid()
+        return state
+
+    def write_checkpoint(self, sync=True):
+        """Queue a checkpoint of the running session"""
+        state = self.checkpoint_state()
+        self.last_checkpoint = time.monotonic()
+        self.io.submit(lambda: self.checkpoint.save(state, sync))
+
+    def on_store_error(self, error):
+        messagebox.showerror("Error", f"Error opening session history: {str(error)}")
+
+    def fill_projects_and_rates(self, index):
+        """Show the indexed projects and rates while the store is still opening"""
+        self.project_search = ProjectSearch(index['projects'], index['recent'])
+        self.filter_projects()
+        if index['rates']:
+            self.rate_combo['values'] = index['rates']
 
     def load_projects_and_rates(self):
         try:
-            df = pd.read_excel(self.excel_file)
-            projects = sorted(df['Project'].dropna().unique())
-            rates = sorted(df['Rate'].dropna().unique())
+            # Keep rates added with "+" while the store was opening
+            rates = set(self.engine.rates()) | {float(r) for r in self.rate_combo['values'] or ()}
 
-            if len(projects) > 0:
-                self.project_combo['values'] = projects
+            self.filter_projects()
             if len(rates) > 0:
-                self.rate_combo['values'] = rates
+                self.rate_combo['values'] = sorted(rates)
 
             # If there was a previous selection, update the totals
             if self.project_var.get() and self.rate_var.get():
                 self.update_project_totals()
         except Exception as e:
-            print(f"Info: Creating new Excel file: {str(e)}")
+            print(f"Error loading projects and rates: {str(e)}")
+
+    def filter_projects(self, event=None):
+        """List the projects matching what has been typed so far"""
+        if event is not None and event.keysym in ("Up", "Down", "Return", "Escape", "Tab"):
+            return
+        self.project_combo['values'] = self.project_search.search(self.project_var.get())
+
+    def pick_project(self, event=None):
+        """Complete the typed text to the best matching project"""
+        if self.project_var.get() not in self.project_search:
+            matches = self.project_search.search(self.project_var.get(), limit=1)
+            if not matches:
+                return
+            self.project_var.set(matches[0])
+            self.project_combo.icursor(tk.END)
+        self.update_project_totals()
+
+    def open_history(self):
+        """Open the session history, or bring it to the front"""
+        if self.history is not None and self.history.window.winfo_exists():
+            self.history.window.lift()
+        else:
+            self.history = HistoryWindow(self)
 
     def on_project_or_rate_change(self, event=None):
         """Called when either project or rate selection changes"""
@@ -268,36 +729,61 @@ class TimeTrackerApp:
 
         if project and rate:
             try:
-                df = pd.read_excel(self.excel_file)
+                # Total time for the project (zero for a new project)
+                self.total_time = self.engine.project_time(project)
                 
-                # Filter by project
-                project_data = df[df['Project'] == project]
+                # Calculate rate per minute
+                self.rate_per_minute = rate_per_minute(rate)
                 
-                if not project_data.empty:
-                    # Calculate total minutes for the project and convert to Python int
-                    total_minutes = int(project_data['Duration_Minutes'].sum())
-                    self.total_time = timedelta(minutes=total_minutes)
-                    
-                    # Calculate rate per minute
-                    self.rate_per_minute = rate / 8 / 60  # rate per 8-hour day converted to per minute
-                    
-                    # Update the displays
-                    self.update_billing()
-                else:
-                    # New project, reset totals
-                    self.total_time = timedelta()
-                    self.rate_per_minute = rate / 8 / 60
-                    self.update_billing()
+                # Update the displays
+                self.update_billing()
             except Exception as e:
                 print(f"Error updating totals: {str(e)}")
 
+    def start_timer(self):
+        """Start the timer display for the running session"""
+        self.stop_timer()
+        # Time on the engine's session clock at which the session's elapsed
+        # time was zero
+        self.timer_anchor = session_clock() - self.engine.elapsed().total_seconds()
+        self.update_timer()
+
+    def stop_timer(self):
+        if self.timer_job is not None:
+            self.root.after_cancel(self.timer_job)
+            self.timer_job = None
+        self.timer_text = None
+
+    def on_restore(self, event=None):
+        """Refresh the timer at once when the window comes back from minimized"""
+        if event is not None and event.widget is not self.root:
+            return
+        if self.engine.is_tracking and self.timer_job is not None:
+            self.root.after_cancel(self.timer_job)
+            self.update_timer()
+
     def update_timer(self):
-        """Update the timer display every second"""
-        if self.is_tracking and self.start_time:
-            elapsed = datetime.now() - self.start_time
-            self.timer_label.config(text=self.format_timer(elapsed))
-            # Schedule next update
-            self.root.after(1000, self.update_timer)
+        """Update the timer display on each whole second of the session"""
+        self.timer_job = None
+        if not self.engine.is_tracking:
+            return
+
+        text = self.format_timer(self.engine.elapsed())
+        if text != self.timer_text:
+            self.timer_label.config(text=text)
+            self.timer_text = text
+
+        # Refresh the checkpoint's last-seen time now and then
+        if (self.last_checkpoint is None
+                or time.monotonic() - self.last_checkpoint >= CHECKPOINT_INTERVAL):
+            self.write_checkpoint(sync=False)
+
+        # Schedule the next tick for just after the next boundary, measured on
+        # the session clock so late callbacks do not accumulate drift
+        interval = MINIMIZED_TIMER_INTERVAL if self.root.state() == "iconic" else 1
+        since_anchor = session_clock() - self.timer_anchor
+        delay = interval - since_anchor % interval
+        self.timer_job = self.root.after(int(delay * 1000) + TIMER_SLACK_MS, self.update_timer)
 
     def update_billing(self):
         """Update the billing display"""
@@ -314,12 +800,12 @@ class TimeTrackerApp:
                 messagebox.showwarning("Warning", "Project name cannot be empty.")
                 return
                 
-            current_projects = list(self.project_combo['values']) if self.project_combo['values'] else []
-            
-            if project_name not in current_projects:
-                current_projects.append(project_name)
-                self.project_combo['values'] = sorted(current_projects)
+            if project_name not in self.project_search:
+                self.project_search.touch(project_name)
                 self.project_var.set(project_name)
+                self.filter_projects()
+                # Persist it now, so it is listed even before its first session
+                self.io.submit(lambda: self.engine.index.add(used=[project_name]))
                 self.update_project_totals()
             else:
                 messagebox.showwarning("Warning", "This project already exists.")
@@ -332,20 +818,21 @@ class TimeTrackerApp:
                 messagebox.showwarning("Warning", "Rate must be greater than zero.")
                 return
                 
-            current_rates = list(self.rate_combo['values']) if self.rate_combo['values'] else []
+            current_rates = [float(r) for r in self.rate_combo['values'] or ()]
             
             if rate_value not in current_rates:
                 current_rates.append(rate_value)
                 self.rate_combo['values'] = sorted(current_rates)
                 self.rate_var.set(rate_value)
-                self.rate_per_minute = rate_value / 8 / 60
+                self.io.submit(lambda: self.engine.index.add(rates=[rate_value]))
+                self.rate_per_minute = rate_per_minute(rate_value)
                 self.update_project_totals()
             else:
                 messagebox.showwarning("Warning", "This rate already exists.")
 
     def toggle_tracking(self):
         """Toggle between start and stop tracking"""
-        if not self.is_tracking:
+        if not self.engine.is_tracking:
             self.start_tracking()
         else:
             self.stop_tracking()
@@ -355,83 +842,120 @@ class TimeTrackerApp:
         if not self.project_var.get() or not self.rate_var.get():
             messagebox.showwarning("Warning", "Please select a project and rate.")
             return
-        
-        self.current_project = self.project_var.get()
+        if self.project_var.get() not in self.project_search:
+            messagebox.showwarning("Warning", "Unknown project. Use '+' to add a new project.")
+            return
+
+        # A session started from the command line, another window's, or one
+        # left by a crash (the store may still be opening and not offered it yet)
+        interrupted = self.checkpoint.load()
+        if interrupted is not None and interrupted['owner'] != os.getpid():
+            if self.checkpoint.held_elsewhere(interrupted):
+                messagebox.showwarning(
+                    "Warning", f"{interrupted['project']} is being timed in another TimeTracker window.")
+                return
+            self.recover_session(interrupted)
+            if self.engine.is_tracking:
+                # Chose to continue timing it
+                return
+
         try:
-            self.current_rate = float(self.rate_var.get())
-        except ValueError:
-            messagebox.showerror("Error", "Invalid rate value.")
+            self.engine.start(self.project_var.get(), self.rate_var.get(), self.currency_var.get())
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
             return
             
-        self.start_time = datetime.now()
-        self.is_tracking = True
-        self.start_button.config(text="STOP", bg="#f44336")
-        self.update_timer()
-        
-        # Disable project and rate selection while tracking
-        self.project_combo.config(state="disabled")
-        self.rate_combo.config(state="disabled")
-        self.currency_combo.config(state="disabled")
-        self.add_project_button.config(state="disabled")
-        self.add_rate_button.config(state="disabled")
+        self.write_checkpoint()
+        self.show_tracking(True)
+        self.start_timer()
+
+    def show_tracking(self, tracking):
+        """Switch the controls between tracking and idle"""
+        if tracking:
+            self.start_button.config(text="STOP", bg="#f44336")
+            
+            # Disable project and rate selection while tracking
+            self.project_combo.config(state="disabled")
+            self.rate_combo.config(state="disabled")
+            self.currency_combo.config(state="disabled")
+            self.add_project_button.config(state="disabled")
+            self.add_rate_button.config(state="disabled")
+        else:
+            self.start_button.config(text="START", bg="#4CAF50")
+            self.timer_label.config(text="00:00:00")
+            
+            # Re-enable project, rate and currency selection
+            self.project_combo.config(state="normal")
+            self.rate_combo.config(state="readonly")
+            self.currency_combo.config(state="readonly")
+            self.add_project_button.config(state="normal")
+            self.add_rate_button.config(state="normal")
 
     def stop_tracking(self):
         """Stop time tracking and save the session"""
-        if self.is_tracking and self.start_time:
-            end_time = datetime.now()
-            duration = end_time - self.start_time
-            duration_minutes = max(1, int(duration.total_seconds() / 60))  # Minimum 1 minute
-            
-            try:
-                # Validate current_rate before saving
-                if self.current_rate is None or self.current_rate <= 0:
-                    messagebox.showerror("Error", "Invalid rate value for saving session.")
-                    return
-                
-                # Create new record as DataFrame directly with explicit dtypes
-                new_record = pd.DataFrame({
-                    'Project': [str(self.current_project)],
-                    'Date': [self.start_time.date()],
-                    'Start_Time': [self.start_time.strftime('%H:%M:%S')],
-                    'End_Time': [end_time.strftime('%H:%M:%S')],
-                    'Duration_Minutes': [duration_minutes],
-                    'Rate': [float(self.current_rate)],
-                    'Currency': [str(self.currency_var.get())]
-                })
-
-                # Read existing data
-                df = pd.read_excel(self.excel_file)
-                
-                # Concatenate and save
-                df = pd.concat([df, new_record], ignore_index=True)
-                df.to_excel(self.excel_file, index=False)
-                
-                # Update the total time and billing
-                self.update_project_totals()
-                
-                # Show success message
-                messagebox.showinfo("Success", f"Session saved: {duration_minutes} minutes")
-                
-            except Exception as e:
-                messagebox.showerror("Error", f"Error saving session: {str(e)}")
-                print(f"Debug - current_rate: {self.current_rate}, type: {type(self.current_rate)}")
-                print(f"Debug - currency: {self.currency_var.get()}")
+        state = self.checkpoint_state()
+        new_record = self.engine.stop()
+        self.stop_timer()
+        self.last_checkpoint = None
+        if new_record is not None:
+            # Save in the background; the checkpoint is cleared once stored
+            self.save_session_async(new_record, state)
         
-        # Reset tracking state
-        self.is_tracking = False
-        self.current_project = None
-        self.current_rate = None
-        self.start_time = None
+        self.show_tracking(False)
+
+    def on_session_saved(self, record):
+        self.sessions_saved = True
+        self.engine.account(record)
+        self.project_search.touch(record['Project'])
+        self.filter_projects()
         
-        self.start_button.config(text="START", bg="#4CAF50")
-        self.timer_label.config(text="00:00:00")
+        # Update the total time and billing
+        self.update_project_totals()
         
-        # Re-enable project, rate and currency selection
-        self.project_combo.config(state="readonly")
-        self.rate_combo.config(state="readonly")
-        self.currency_combo.config(state="readonly")
-        self.add_project_button.config(state="normal")
-        self.add_rate_button.config(state="normal")
+        # Show success message
+        if not self.closing:
+            messagebox.showinfo("Success", f"Session saved: {record['Duration_Minutes']} minutes")
+
+    def on_session_taken(self, record):
+        if not self.closing:
+            messagebox.showwarning(
+                "Warning", f"The session for {record['Project']} was stopped outside this window "
+                           f"(for example with 'tracker_cli.py stop') and is not saved again.")
+
+    def on_session_error(self, record, error):
+        messagebox.showerror("Error", f"Error saving session: {str(error)}\n"
+                             f"It stays in {self.checkpoint.path} until the next session starts.")
+        print(f"Debug - record: {record}")
+
+    def close_store(self):
+        """Bring the workbook up to date and close the store (runs on the I/O worker)"""
+        store = self.engine.store
+        if store is None:
+            return
+        self.engine.writer.flush()
+        try:
+            # The workbook stays available for accounting as an export
+            refresh_export(store, self.excel_file, self.sessions_saved)
+        finally:
+            store.close()
+
+    def on_close(self):
+        """Save any running session and shut the store down before exiting"""
+        if self.closing:
+            return
+        self.closing = True
+        if self.engine.is_tracking:
+            self.stop_tracking()
+        self.start_button.config(state="disabled")
+        self.io.submit(self.close_store, self.on_store_closed, self.on_store_close_error)
+
+    def on_store_closed(self, result=None):
+        self.io.stop()
+        self.root.destroy()
+
+    def on_store_close_error(self, error):
+        messagebox.showerror("Error", f"Error writing {self.excel_file}: {str(error)}")
+        self.on_store_closed()
 
 if __name__ == "__main__":
     root = tk.Tk()
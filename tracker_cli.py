@@ -0,0 +1,241 @@
+# Command-line interface for TimeTracker
+#
+# Starts and stops sessions against the same store as the window, for use
+# from scripts and build hooks. Neither tkinter nor pandas is imported, except
+# pandas when a report is exported as a workbook.
+#
+#   python tracker_cli.py start "Project" --rate 400 --currency EUR
+#   python tracker_cli.py stop
+#   python tracker_cli.py status
+#   python tracker_cli.py totals [PROJECT]
+#   python tracker_cli.py report [--csv FILE | --excel FILE]
+#   python tracker_cli.py invoice [--period month] [--from DATE] [--to DATE] [--output FILE]
+
+import argparse
+import csv
+import sys
+from datetime import datetime, timedelta
+from tracker_engine import TrackingEngine, CURRENCIES, format_amount, format_duration, rate_per_minute
+from tracker_storage import (
+    DEFAULT_CHECKPOINT_FILE, DEFAULT_DATA_FILE, DEFAULT_EXCEL_FILE, DEFAULT_INDEX_FILE,
+    DEFAULT_PENDING_FILE, ProjectIndex, SessionCheckpoint, WriteBehindQueue, open_store
+)
+
+
+def running_engine(args):
+    """Engine resumed from the checkpoint file, or None if no session is running"""
+    state = SessionCheckpoint(args.active).load()
+    if state is None:
+        return None
+    engine = TrackingEngine()
+    engine.restore(state)
+    return engine
+
+
+def window_owner(args):
+    """Process id of a window timing the running session, or None"""
+    checkpoint = SessionCheckpoint(args.active)
+    state = checkpoint.load()
+    if state is not None and checkpoint.held_elsewhere(state):
+        return state['owner']
+    return None
+
+
+def open_engine(args):
+    """Engine on the store, with sessions still queued by earlier calls stored"""
+    engine = TrackingEngine(open_store(args.data, args.workbook))
+    engine.writer = WriteBehindQueue(engine.store, args.pending)
+    engine.index = ProjectIndex(args.index)
+    if engine.writer.flush():
+        engine.totals = engine.load_totals()
+    return engine
+
+
+def cmd_start(args):
+    engine = running_engine(args)
+    if engine is not None:
+        print(f"Error: already tracking {engine.current_project} since "
+              f"{engine.start_time:%Y-%m-%d %H:%M:%S}", file=sys.stderr)
+        return 1
+    engine = TrackingEngine()
+    engine.start(args.project, args.rate, args.currency)
+    SessionCheckpoint(args.active).save(engine.snapshot())
+    print(f"Started {args.project} at {engine.start_time:%H:%M:%S}")
+    return 0
+
+
+def cmd_stop(args):
+    engine = running_engine(args)
+    if engine is None:
+        print("Error: no session is running", file=sys.stderr)
+        return 1
+    owner = window_owner(args)
+    if owner is not None:
+        # The window would save it again when stopped there
+        print(f"Error: {engine.current_project} is being timed in the TimeTracker window "
+              f"(process {owner}); stop it there", file=sys.stderr)
+        return 1
+    record = engine.stop()
+    # Queued durably; written to the store in a batch with other sessions
+    engine.store = open_store(args.data, args.workbook)
+    engine.writer = WriteBehindQueue(engine.store, args.pending)
+    engine.index = ProjectIndex(args.index)
+    try:
+        engine.save(record)
+    finally:
+        engine.store.close()
+    # Cleared only once the session is safely stored
+    SessionCheckpoint(args.active).clear()
+    print(f"Session saved: {record['Project']}, {record['Duration_Minutes']} minutes")
+    return 0
+
+
+def cmd_status(args):
+    engine = running_engine(args)
+    if engine is None:
+        print("Idle")
+        return 0
+    print(f"Tracking {engine.current_project} for {format_duration(engine.elapsed())} "
+          f"({format_amount(engine.current_rate, engine.current_currency)} per day)")
+    owner = window_owner(args)
+    if owner is not None:
+        print(f"Timed in the TimeTracker window (process {owner})")
+    return 0
+
+
+def summary_rows(engine):
+    """Rows of (project, rate, currency, minutes, amount) from the totals cache"""
+    rows = []
+    for (project, rate, currency), minutes in sorted(engine.totals.by_key.items()):
+        rows.append((project, rate, currency, minutes, minutes * rate_per_minute(rate)))
+    return rows
+
+
+def cmd_totals(args):
+    engine = open_engine(args)
+    try:
+        projects = [args.project] if args.project else engine.projects()
+        for project in projects:
+            print(f"{project}\t{format_duration(engine.project_time(project))}")
+    finally:
+        engine.store.close()
+    return 0
+
+
+def cmd_report(args):
+    engine = open_engine(args)
+    try:
+        if args.excel_out:
+            # Full session history for accounting; this needs pandas
+            engine.store.export_excel(args.excel_out)
+            print(f"Wrote {args.excel_out}")
+            return 0
+        rows = summary_rows(engine)
+    finally:
+        engine.store.close()
+
+    if args.csv_out:
+        with open(args.csv_out, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(['Project', 'Rate', 'Currency', 'Duration_Minutes', 'Amount'])
+            writer.writerows(rows)
+        print(f"Wrote {args.csv_out}")
+        return 0
+
+    for project, rate, currency, minutes, amount in rows:
+        print(f"{project}\t{format_amount(rate, currency)}/day\t"
+              f"{format_duration(timedelta(minutes=minutes))}\t{format_amount(amount, currency)}")
+    return 0
+
+
+def cmd_invoice(args):
+    # Imported here: this is the only command that always needs pandas
+    from tracker_report import currency_totals, store_report, write_report
+    engine = open_engine(args)
+    try:
+        report = store_report(engine.store, None if args.period == "all" else args.period,
+                              args.project, args.date_from, args.date_to)
+    finally:
+        engine.store.close()
+
+    if args.output:
+        write_report(report, args.output)
+        print(f"Wrote {args.output}")
+        return 0
+
+    for row in report.itertuples(index=False):
+        print(f"{row.Period}\t{row.Project}\t{format_amount(row.Rate, row.Currency)}/day\t"
+              f"{format_duration(timedelta(minutes=int(row.Duration_Minutes)))}\t"
+              f"{format_amount(row.Amount, row.Currency)}")
+    for row in currency_totals(report).itertuples(index=False):
+        print(f"{row.Period}\tTotal {row.Currency}\t\t"
+              f"{format_duration(timedelta(minutes=int(row.Duration_Minutes)))}\t"
+              f"{format_amount(row.Amount, row.Currency)}")
+    return 0
+
+
+def iso_date(text):
+    """argparse type for YYYY-MM-DD dates, kept as text"""
+    try:
+        datetime.strptime(text, "%Y-%m-%d")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid date: {text} (expected YYYY-MM-DD)")
+    return text
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="tracker_cli", description="TimeTracker command line")
+    parser.add_argument("--data", default=DEFAULT_DATA_FILE, help="session store file")
+    parser.add_argument("--workbook", default=DEFAULT_EXCEL_FILE,
+                        help="workbook imported on first run")
+    parser.add_argument("--active", default=DEFAULT_CHECKPOINT_FILE, help="running session checkpoint file")
+    parser.add_argument("--pending", default=DEFAULT_PENDING_FILE, help="write-behind queue journal")
+    parser.add_argument("--index", default=DEFAULT_INDEX_FILE, help="project and rate index file")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    start = commands.add_parser("start", help="start tracking a project")
+    start.add_argument("project")
+    start.add_argument("--rate", type=float, required=True, help="rate per 8-hour day")
+    start.add_argument("--currency", default="EUR", choices=list(CURRENCIES))
+    start.set_defaults(func=cmd_start)
+
+    stop = commands.add_parser("stop", help="stop and save the running session")
+    stop.set_defaults(func=cmd_stop)
+
+    status = commands.add_parser("status", help="show the running session")
+    status.set_defaults(func=cmd_status)
+
+    totals = commands.add_parser("totals", help="total time per project")
+    totals.add_argument("project", nargs="?")
+    totals.set_defaults(func=cmd_totals)
+
+    report = commands.add_parser("report", help="time and amount per project, rate and currency")
+    output = report.add_mutually_exclusive_group()
+    output.add_argument("--csv", dest="csv_out", help="write the summary as CSV")
+    output.add_argument("--excel", dest="excel_out", help="export the full history as a workbook")
+    report.set_defaults(func=cmd_report)
+
+    invoice = commands.add_parser("invoice", help="billing summary per period, project, rate and currency")
+    invoice.add_argument("--period", default="month", choices=["day", "week", "month", "quarter", "year", "all"])
+    invoice.add_argument("--project", help="only this project")
+    invoice.add_argument("--from", dest="date_from", type=iso_date, metavar="DATE",
+                         help="first day (YYYY-MM-DD)")
+    invoice.add_argument("--to", dest="date_to", type=iso_date, metavar="DATE",
+                         help="last day (YYYY-MM-DD)")
+    invoice.add_argument("--output", metavar="FILE", help="write the summary to a .csv or .xlsx file")
+    invoice.set_defaults(func=cmd_invoice)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        return args.func(args)
+    except (ValueError, OSError, ImportError) as e:
+        print(f"Error: {str(e)}", file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
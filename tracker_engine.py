@@ -0,0 +1,334 @@
+# Tracking engine for TimeTracker
+#
+# Everything about sessions, rates and totals that does not depend on a
+# window lives here, so the same logic can be driven by the Tk app, the
+# command line, scripts or a server process.
+
+import bisect
+import heapq
+import time
+from datetime import datetime, timedelta
+from tracker_model import local_epoch
+from tracker_storage import TotalsCache, open_store, DEFAULT_DATA_FILE, DEFAULT_EXCEL_FILE
+
+# Rates are entered per 8-hour working day
+HOURS_PER_DAY = 8
+
+# Currency configuration
+CURRENCIES = {
+    "EUR": "€",
+    "USD": "$",
+    "GBP": "£",
+    "JPY": "¥",
+    "CNY": "元"
+}
+
+# Currencies billed in whole units, without decimals
+WHOLE_UNIT_CURRENCIES = ("CNY", "JPY")
+
+# Most project search results shown at once
+SEARCH_LIMIT = 50
+
+
+def rate_per_minute(rate):
+    """Convert a rate per 8-hour day to a rate per minute"""
+    return rate / HOURS_PER_DAY / 60
+
+
+def format_duration(td):
+    """Format timedelta to show only two digits for seconds"""
+    hours = int(td.total_seconds() // 3600)
+    minutes = int((td.total_seconds() % 3600) // 60)
+    seconds = int(td.total_seconds() % 60)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+
+
+def format_amount(amount, currency):
+    """Format amount with currency symbol"""
+    symbol = CURRENCIES.get(currency, currency)
+    if currency in WHOLE_UNIT_CURRENCIES:  # No decimal places for these currencies
+        return f"{int(amount):,} {symbol}"
+    else:
+        return f"{amount:,.2f} {symbol}"
+
+
+def checkpoint_record(state):
+    """Record for an interrupted session, ending when it was last seen alive"""
+    start_time = datetime.fromtimestamp(state['start'])
+    end_time = datetime.fromtimestamp(max(state['start'], state['last_seen']))
+    return session_record(state['project'], state['rate'], state['currency'], start_time, end_time)
+
+
+def session_record(project, rate, currency, start_time, end_time):
+    """Build the stored record for a session between start_time and end_time"""
+    duration = end_time - start_time
+    duration_minutes = max(1, int(duration.total_seconds() / 60))  # Minimum 1 minute
+    start_utc, utc_offset = local_epoch(start_time)
+    return {
+        'Project': str(project),
+        'Date': start_time.date().isoformat(),
+        'Start_Time': start_time.strftime('%H:%M:%S'),
+        'End_Time': end_time.strftime('%H:%M:%S'),
+        'Duration_Minutes': duration_minutes,
+        'Rate': float(rate),
+        'Currency': str(currency),
+        'Start_UTC': start_utc,
+        # Whole seconds, like the Start_Time and End_Time texts
+        'End_UTC': start_utc + int((end_time.replace(microsecond=0)
+                                    - start_time.replace(microsecond=0)).total_seconds()),
+        'UTC_Offset': utc_offset
+    }
+
+
+class ProjectSearch:
+    """Search-as-you-type over project names, most recently used first
+
+    Every word of every name is kept in one sorted list, so the projects with
+    a word starting with the query form one range found by binary search.
+    Small ranges are ranked directly; for large ones (short queries) the
+    projects are walked in rank order until enough of them match. Only when
+    no word matches are names scanned for the query anywhere.
+    """
+
+    # Ranges larger than this are served by walking the ranked list
+    DENSE_RANGE = 1000
+
+    def __init__(self, projects=(), recent=None):
+        self.recent = dict(recent or {})
+        # (lowercased name from a word onwards, project) pairs, sorted
+        self.keys = []
+        # project -> its keys, for matching while walking the ranked list
+        self.words = {}
+        for project in projects:
+            if project not in self.words:
+                self.words[project] = self._words(project)
+                self.keys.extend((word, project) for word in self.words[project])
+        self.keys.sort()
+        # All projects in result order
+        self.ranked = sorted(self.words, key=self._rank)
+
+    def __contains__(self, project):
+        return project in self.words
+
+    def __len__(self):
+        return len(self.words)
+
+    @staticmethod
+    def _words(project):
+        name = project.lower()
+        return [name[i:] for i, char in enumerate(name)
+                if char.isalnum() and (i == 0 or not name[i - 1].isalnum())]
+
+    def _rank(self, project):
+        return (-self.recent.get(project, 0), project.lower(), project)
+
+    def add(self, project):
+        if project in self.words:
+            return
+        self.words[project] = self._words(project)
+        for word in self.words[project]:
+            bisect.insort(self.keys, (word, project))
+        self.ranked.insert(self._position(project), project)
+
+    def _position(self, project):
+        """Index in self.ranked where project belongs"""
+        rank = self._rank(project)
+        lo, hi = 0, len(self.ranked)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._rank(self.ranked[mid]) < rank:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def touch(self, project, when=None):
+        """Record that a project was just used"""
+        if project in self.words:
+            del self.ranked[self._position(project)]
+            self.recent[project] = when or time.time()
+            self.ranked.insert(self._position(project), project)
+        else:
+            self.recent[project] = when or time.time()
+            self.add(project)
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        """Up to limit projects matching query, most recently used first"""
+        query = query.strip().lower()
+        if not query:
+            return self.ranked[:limit]
+        lo = bisect.bisect_left(self.keys, (query,))
+        hi = bisect.bisect_left(self.keys, (query[:-1] + chr(ord(query[-1]) + 1),), lo)
+        if hi - lo > self.DENSE_RANGE:
+            results = []
+            for project in self.ranked:
+                if any(word.startswith(query) for word in self.words[project]):
+                    results.append(project)
+                    if len(results) == limit:
+                        break
+            return results
+        matches = {project for _, project in self.keys[lo:hi]}
+        if not matches:
+            matches = {p for p in self.words if query in p.lower()}
+        return heapq.nsmallest(limit, matches, key=self._rank)
+
+
+if hasattr(time, "CLOCK_BOOTTIME"):
+    def session_clock():
+        """Seconds on a clock that keeps counting while the machine sleeps"""
+        return time.clock_gettime(time.CLOCK_BOOTTIME)
+else:
+    # Where CLOCK_BOOTTIME is missing (macOS, Windows, Python < 3.7) the
+    # monotonic clock is used; on macOS it stops while the machine sleeps
+    session_clock = time.monotonic
+
+
+class TrackingEngine:
+    """Runs one session at a time and keeps project totals current"""
+
+    def __init__(self, store=None):
+        self.store = store
+        # Optional WriteBehindQueue that batches writes to the store
+        self.writer = None
+        # Optional ProjectIndex kept up to date with saved sessions
+        self.index = None
+        self.totals = self.load_totals() if store is not None else TotalsCache()
+
+        self.current_project = None
+        self.current_rate = None
+        self.current_currency = None
+        # Wall-clock anchor for the stored date and times; durations are
+        # measured from start_monotonic (a session_clock reading) so clock
+        # corrections cannot skew them
+        self.start_time = None
+        self.start_monotonic = None
+
+    @classmethod
+    def open(cls, data_file=DEFAULT_DATA_FILE, excel_file=DEFAULT_EXCEL_FILE):
+        """Create an engine on the default store, importing the workbook on first run"""
+        return cls(open_store(data_file, excel_file))
+
+    def load_totals(self):
+        """Aggregate the store into a new totals cache"""
+        totals = TotalsCache()
+        totals.load(self.store)
+        return totals
+
+    @property
+    def is_tracking(self):
+        return self.start_time is not None
+
+    def start(self, project, rate, currency, now=None):
+        """Start a session; raises ValueError for missing or invalid input"""
+        if self.is_tracking:
+            raise ValueError(f"Already tracking {self.current_project}.")
+        if not project or not rate:
+            raise ValueError("Please select a project and rate.")
+        try:
+            rate = float(rate)
+        except (TypeError, ValueError):
+            raise ValueError("Invalid rate value.")
+        if rate <= 0:
+            raise ValueError("Invalid rate value.")
+
+        self.current_project = project
+        self.current_rate = rate
+        self.current_currency = currency
+        self.start_time = now or datetime.now()
+        self.start_monotonic = session_clock()
+
+    def elapsed(self, now=None):
+        """Time spent in the running session
+
+        Measured on session_clock, so NTP corrections and DST changes do not
+        affect it and time asleep is counted like the wall clock counts it,
+        except where only a monotonic clock that stops in sleep is available
+        (macOS): there a suspended machine's sleep is left out of the
+        session. Sessions restored from a checkpoint (another process,
+        possibly another boot) fall back to the wall clock.
+        """
+        if not self.is_tracking:
+            return timedelta()
+        if now is None and self.start_monotonic is not None:
+            return timedelta(seconds=session_clock() - self.start_monotonic)
+        return (now or datetime.now()) - self.start_time
+
+    def stop(self, now=None):
+        """End the running session and return its record, or None if idle
+
+        The record is not saved; pass it to commit (or save and account).
+        """
+        if not self.is_tracking:
+            return None
+        # The end time shown in the history is derived from the measured
+        # duration, so it always agrees with Duration_Minutes
+        end_time = self.start_time + self.elapsed(now)
+        record = session_record(self.current_project, self.current_rate,
+                                self.current_currency, self.start_time, end_time)
+        self.cancel()
+        return record
+
+    def snapshot(self, now=None):
+        """Checkpoint state for the running session, or None if idle"""
+        if not self.is_tracking:
+            return None
+        return {
+            'project': self.current_project,
+            'rate': self.current_rate,
+            'currency': self.current_currency,
+            'start': self.start_time.timestamp(),
+            'last_seen': (now or datetime.now()).timestamp()
+        }
+
+    def restore(self, state):
+        """Continue the session described by a checkpoint state"""
+        self.current_project = state['project']
+        self.current_rate = state['rate']
+        self.current_currency = state['currency']
+        self.start_time = datetime.fromtimestamp(state['start'])
+        # A monotonic reading from another process means nothing here
+        self.start_monotonic = None
+
+    def cancel(self):
+        """Forget the running session without recording it"""
+        self.current_project = None
+        self.current_rate = None
+        self.current_currency = None
+        self.start_time = None
+        self.start_monotonic = None
+
+    def save(self, record):
+        """Write a finished session to the store, or queue it for a batched write"""
+        if self.writer is not None:
+            self.writer.add(record)
+        else:
+            self.store.add_session(record)
+        if self.index is not None:
+            self.index.add_record(record)
+
+    def account(self, record):
+        """Add a saved session to the running totals"""
+        self.totals.add(record)
+
+    def commit(self, record):
+        self.save(record)
+        self.account(record)
+
+    def projects(self):
+        """Projects with sessions, plus any in the index that have none yet"""
+        if self.index is None:
+            return self.totals.projects()
+        return sorted(set(self.totals.projects()) | set(self.index.load()['projects']))
+
+    def rates(self):
+        if self.index is None:
+            return self.totals.rates()
+        return sorted(set(self.totals.rates()) | set(self.index.load()['rates']))
+
+    def project_time(self, project):
+        """Total time logged on a project"""
+        return timedelta(minutes=self.totals.project_minutes(project))
+
+    def amount(self, project, rate):
+        """Amount to bill for all time on a project at the given day rate"""
+        return self.totals.project_minutes(project) * rate_per_minute(rate)
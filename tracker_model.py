@@ -0,0 +1,252 @@
+# Compact in-memory session model for TimeTracker
+#
+# Session is a small record with __slots__; SessionTable stores many of them
+# column-wise in typed arrays, with start and end as epoch seconds,
+# projects and currencies interned to small integer ids and rates as integer
+# cents. A million sessions take about 35 MB here instead of hundreds of
+# megabytes as a DataFrame of Python objects.
+#
+# Start and end are UTC epoch seconds, with the UTC offset in minutes of the
+# local clock the session was recorded on. Start plus offset gives back the
+# stored Date and Start_Time; the end is the start plus the session's length
+# on that clock, so End_Time round-trips too.
+
+import time
+from array import array
+from bisect import bisect_left
+from calendar import timegm
+from datetime import datetime, timedelta
+
+# Rates are held as integer hundredths of the currency unit
+RATE_SCALE = 100
+
+
+def local_epoch(moment):
+    """Return (UTC epoch seconds, UTC offset in minutes) of a naive local datetime"""
+    fields = moment.timetuple()
+    epoch = int(time.mktime(fields))
+    return epoch, (timegm(fields) - epoch) // 60
+
+
+def clock_seconds(clock):
+    """Seconds since midnight of an HH:MM:SS time"""
+    return int(clock[:2]) * 3600 + int(clock[3:5]) * 60 + int(clock[6:8])
+
+
+def record_epochs(record):
+    """Return (Start_UTC, End_UTC, UTC_Offset) from a record's local Date and times"""
+    start = datetime.strptime(record['Date'], "%Y-%m-%d") + timedelta(
+        seconds=clock_seconds(record['Start_Time']))
+    start_utc, offset = local_epoch(start)
+    # Ended after midnight if the end time is before the start time
+    length = (clock_seconds(record['End_Time']) - clock_seconds(record['Start_Time'])) % 86400
+    return start_utc, start_utc + length, offset
+
+
+def with_epochs(record):
+    """Fill in the epoch fields of a record written before they existed"""
+    if 'Start_UTC' not in record:
+        record['Start_UTC'], record['End_UTC'], record['UTC_Offset'] = record_epochs(record)
+    return record
+
+
+def day_bounds(date_from=None, date_to=None):
+    """Epoch range [low, high) of the local days date_from to date_to (ISO dates)
+
+    Either end is None when its date is not given.
+    """
+    low = high = None
+    if date_from:
+        low = local_epoch(datetime.strptime(date_from, "%Y-%m-%d"))[0]
+    if date_to:
+        high = local_epoch(datetime.strptime(date_to, "%Y-%m-%d") + timedelta(days=1))[0]
+    return low, high
+
+
+def wall_datetime(seconds):
+    return datetime(1970, 1, 1) + timedelta(seconds=seconds)
+
+
+class Session:
+    """One finished session"""
+
+    __slots__ = ('project', 'start', 'end', 'offset', 'minutes', 'rate_cents', 'currency')
+
+    def __init__(self, project, start, end, offset, minutes, rate_cents, currency):
+        self.project = project
+        self.start = start
+        self.end = end
+        self.offset = offset
+        self.minutes = minutes
+        self.rate_cents = rate_cents
+        self.currency = currency
+
+    @classmethod
+    def from_record(cls, record):
+        if 'Start_UTC' in record:
+            start, end, offset = record['Start_UTC'], record['End_UTC'], record['UTC_Offset']
+        else:
+            start, end, offset = record_epochs(record)
+        return cls(record['Project'], int(start), int(end), int(offset), int(record['Duration_Minutes']),
+                   int(round(float(record['Rate']) * RATE_SCALE)), record['Currency'])
+
+    @property
+    def rate(self):
+        return self.rate_cents / RATE_SCALE
+
+    def to_record(self):
+        start = wall_datetime(self.start + self.offset * 60)
+        return {
+            'Project': self.project,
+            'Date': start.date().isoformat(),
+            'Start_Time': start.strftime('%H:%M:%S'),
+            'End_Time': wall_datetime(self.end + self.offset * 60).strftime('%H:%M:%S'),
+            'Duration_Minutes': self.minutes,
+            'Rate': self.rate,
+            'Currency': self.currency,
+            'Start_UTC': self.start,
+            'End_UTC': self.end,
+            'UTC_Offset': self.offset
+        }
+
+    def __repr__(self):
+        start = wall_datetime(self.start + self.offset * 60)
+        return (f"Session({self.project!r}, {start:%Y-%m-%d %H:%M:%S}, "
+                f"{self.minutes} min, {self.rate} {self.currency})")
+
+
+class SessionTable:
+    """Column-wise table of sessions in typed arrays"""
+
+    def __init__(self, records=()):
+        self.start = array('q')
+        self.end = array('q')
+        self.offsets = array('h')
+        self.minutes = array('i')
+        self.rate_cents = array('q')
+        self.project_ids = array('I')
+        self.currency_ids = array('H')
+        # Interned names; ids index these lists
+        self.project_names = []
+        self.currency_names = []
+        self._project_index = {}
+        self._currency_index = {}
+        # Whether start is in ascending order, so date ranges can be bisected
+        self.ordered = True
+        self.extend(records)
+
+    def __len__(self):
+        return len(self.start)
+
+    def __getitem__(self, i):
+        return Session(self.project_names[self.project_ids[i]], self.start[i], self.end[i], self.offsets[i],
+                       self.minutes[i], self.rate_cents[i], self.currency_names[self.currency_ids[i]])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    @classmethod
+    def concat(cls, tables):
+        """One table holding the sessions of several tables, in order"""
+        combined = cls()
+        for table in tables:
+            if not table.ordered or (combined.start and table.start and table.start[0] < combined.start[-1]):
+                combined.ordered = False
+            project_map = [combined._intern(combined.project_names, combined._project_index, name)
+                           for name in table.project_names]
+            currency_map = [combined._intern(combined.currency_names, combined._currency_index, name)
+                            for name in table.currency_names]
+            for column in ('start', 'end', 'offsets', 'minutes', 'rate_cents'):
+                getattr(combined, column).extend(getattr(table, column))
+            combined.project_ids.extend(project_map[i] for i in table.project_ids)
+            combined.currency_ids.extend(currency_map[i] for i in table.currency_ids)
+        return combined
+
+    def _intern(self, names, index, name):
+        if name not in index:
+            index[name] = len(names)
+            names.append(name)
+        return index[name]
+
+    def append(self, session):
+        """Add a Session or a record dict"""
+        if isinstance(session, dict):
+            session = Session.from_record(session)
+        if self.start and session.start < self.start[-1]:
+            self.ordered = False
+        self.start.append(session.start)
+        self.end.append(session.end)
+        self.offsets.append(session.offset)
+        self.minutes.append(session.minutes)
+        self.rate_cents.append(session.rate_cents)
+        self.project_ids.append(self._intern(self.project_names, self._project_index, session.project))
+        self.currency_ids.append(self._intern(self.currency_names, self._currency_index, session.currency))
+
+    def extend(self, sessions):
+        for session in sessions:
+            self.append(session)
+
+    def project_minutes(self, project):
+        project_id = self._project_index.get(project)
+        if project_id is None:
+            return 0
+        return sum(m for p, m in zip(self.project_ids, self.minutes) if p == project_id)
+
+    def totals(self):
+        """Return (project, rate, currency, minutes) for every combination"""
+        totals = {}
+        for key, minutes in zip(zip(self.project_ids, self.rate_cents, self.currency_ids), self.minutes):
+            totals[key] = totals.get(key, 0) + minutes
+        return [(self.project_names[p], r / RATE_SCALE, self.currency_names[c], m)
+                for (p, r, c), m in totals.items()]
+
+    def select(self, project=None, date_from=None, date_to=None):
+        """Row numbers of the sessions of a project and/or inclusive ISO date range"""
+        low, high = day_bounds(date_from, date_to)
+        start = self.start
+        if self.ordered:
+            # Sessions were added in time order: find the range by bisection
+            rows = range(0 if low is None else bisect_left(start, low),
+                         len(start) if high is None else bisect_left(start, high))
+        else:
+            rows = [i for i in range(len(start))
+                    if (low is None or start[i] >= low) and (high is None or start[i] < high)]
+        if project:
+            project_id = self._project_index.get(project)
+            rows = [i for i in rows if self.project_ids[i] == project_id]
+        return list(rows)
+
+    def sort_key(self, column):
+        """Key function on row numbers for ordering by a record column,
+        ties broken by start time"""
+        start, offsets = self.start, self.offsets
+        keys = {
+            'Project': lambda i: (self.project_names[self.project_ids[i]], start[i]),
+            'Date': lambda i: start[i],
+            'Start_Time': lambda i: ((start[i] + offsets[i] * 60) % 86400, start[i]),
+            'End_Time': lambda i: ((self.end[i] + offsets[i] * 60) % 86400, start[i]),
+            'Duration_Minutes': lambda i: (self.minutes[i], start[i]),
+            'Rate': lambda i: (self.rate_cents[i], start[i]),
+            'Currency': lambda i: (self.currency_names[self.currency_ids[i]], start[i]),
+            'Start_UTC': lambda i: start[i],
+            'End_UTC': lambda i: (self.end[i], start[i]),
+            'UTC_Offset': lambda i: (offsets[i], start[i])
+        }
+        if column not in keys:
+            raise ValueError(f"Cannot sort sessions by {column}.")
+        return keys[column]
+
+    def page(self, project=None, date_from=None, date_to=None,
+             sort='Date', descending=True, offset=0, limit=None):
+        """One page of records, filtered and sorted like a store's sessions()"""
+        rows = self.select(project, date_from, date_to)
+        key = self.sort_key(sort)
+        if not (self.ordered and sort in ('Date', 'Start_UTC')):
+            # Otherwise select already returned them in start order
+            rows.sort(key=key)
+        if descending:
+            # Reversed after sorting, so ties come latest first, like the SQLite store
+            rows.reverse()
+        end = None if limit is None else offset + limit
+        return [self[i].to_record() for i in rows[offset:end]]
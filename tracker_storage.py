@@ -0,0 +1,1788 @@
+# Storage backends for TimeTracker
+#
+# A store keeps the session history and answers the questions the UI asks:
+# which projects and rates exist, and how many minutes a project has logged.
+# ExcelStore works directly on time_tracking.xlsx; SQLiteStore keeps the
+# history in an indexed database and uses the workbook as import/export format.
+
+import json
+import os
+import re
+import shutil
+import sqlite3
+import struct
+import tempfile
+import time
+import uuid
+import zipfile
+import zlib
+from datetime import date, datetime, timedelta
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape as xml_escape
+from tracker_model import SessionTable, day_bounds, record_epochs, with_epochs
+
+# Start_UTC and End_UTC are epoch seconds and UTC_Offset the minutes the local
+# clock was ahead of UTC; Date, Start_Time and End_Time are that local clock
+COLUMNS = ['Project', 'Date', 'Start_Time', 'End_Time', 'Duration_Minutes', 'Rate', 'Currency',
+           'Start_UTC', 'End_UTC', 'UTC_Offset']
+EPOCH_COLUMNS = ['Start_UTC', 'End_UTC', 'UTC_Offset']
+
+DEFAULT_DATA_FILE = "time_tracking.db"
+DEFAULT_EXCEL_FILE = "time_tracking.xlsx"
+DEFAULT_CHECKPOINT_FILE = "time_tracking.active"
+DEFAULT_PENDING_FILE = "time_tracking.pending"
+DEFAULT_INDEX_FILE = "time_tracking.index"
+
+# Sessions per chunk when streaming a workbook
+WORKBOOK_CHUNK = 10000
+
+# Deflate level for sheets rewritten by append_workbook: the sheet is most
+# of the file, and level 1 compresses it several times faster than the default
+SHEET_COMPRESSLEVEL = 1
+
+# Write-behind defaults: flush after this many sessions or this many seconds
+WRITE_BEHIND_MAX_PENDING = 20
+WRITE_BEHIND_MAX_DELAY = 10.0
+
+
+def load_pandas():
+    """Import pandas on first use so plain startup never pays for it"""
+    try:
+        import pandas as pd
+        import openpyxl  # noqa: F401 - needed by read_excel/to_excel
+    except ImportError:
+        raise ImportError("pandas and openpyxl are needed for Excel import/export. "
+                          "Install them with: pip install pandas openpyxl")
+    return pd
+
+
+def load_openpyxl():
+    """Import openpyxl for writing workbooks without pandas"""
+    try:
+        import openpyxl
+    except ImportError:
+        raise ImportError("openpyxl is needed to write workbooks. "
+                          "Install it with: pip install openpyxl")
+    return openpyxl
+
+
+def load_pyarrow():
+    """Import pyarrow for the Parquet store, which is optional"""
+    try:
+        import pyarrow
+        import pyarrow.dataset
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        raise ImportError("pyarrow is needed for the Parquet store. "
+                          "Install it with: pip install pyarrow")
+    return pyarrow
+
+
+class SessionJournal:
+    """Append-only log of completed sessions, one JSON record per line"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def append(self, record):
+        """Append a session record and fsync it so it survives a crash"""
+        self.extend([record])
+
+    def extend(self, records):
+        """Append several records with a single fsync"""
+        lines = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
+        with open(self.path, "a+b") as f:
+            self._cut_torn_tail(f)
+            f.write(lines.encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+
+    @staticmethod
+    def _cut_torn_tail(f):
+        """Drop a last line left without its newline by a crash mid-append,
+        so the next record starts on a line of its own"""
+        size = f.seek(0, os.SEEK_END)
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return
+        position = size
+        while position > 0:
+            step = min(4096, position)
+            position -= step
+            f.seek(position)
+            newline = f.read(step).rfind(b"\n")
+            if newline >= 0:
+                f.truncate(position + newline + 1)
+                return
+        f.truncate(0)
+
+    def read(self):
+        """Return all journaled session records"""
+        if not os.path.exists(self.path):
+            return []
+        records = []
+        with open(self.path, encoding="utf-8", errors="replace") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # A line torn by a crash mid-append; the records after
+                    # it were written and acknowledged, so keep reading
+                    continue
+        return records
+
+    def truncate(self):
+        """Drop all journaled records once they are safely in the workbook"""
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class SessionCheckpoint:
+    """Fixed-size record of the running session, rewritten in place
+
+    The record is 512 bytes so an overwrite never spans more than one disk
+    sector, and carries a CRC so a torn write is detected instead of trusted.
+    Its owner is the process id of the window timing the session, or 0 for
+    a session started from the command line that no process is timing.
+    """
+
+    MAGIC = b"TTCP"
+    # magic, version, project length, start, last seen, rate, currency, owner, project, crc
+    RECORD = struct.Struct("<4sHHddd8sI464sI")
+    VERSION = 1
+    # A window refreshes last_seen every 30 seconds; an owner that has not
+    # for this long is taken to be gone (closed or crashed)
+    OWNER_TIMEOUT = 120.0
+
+    def __init__(self, path=DEFAULT_CHECKPOINT_FILE):
+        self.path = path
+
+    def save(self, state, sync=True):
+        """Write state (project, rate, currency, start, last_seen and optionally
+        owner) or clear it if None"""
+        if state is None:
+            payload = bytes(self.RECORD.size - 4)
+        else:
+            project = state['project'].encode("utf-8")
+            if len(project) > 464:
+                raise ValueError("Project name is too long.")
+            payload = self.RECORD.pack(
+                self.MAGIC, self.VERSION, len(project), state['start'], state['last_seen'],
+                state['rate'], state['currency'].encode("utf-8"), state.get('owner', 0),
+                project, 0)[:-4]
+        record = payload + struct.pack("<I", zlib.crc32(payload))
+        mode = "r+b" if os.path.exists(self.path) else "wb"
+        with open(self.path, mode) as f:
+            f.write(record)
+            f.flush()
+            if sync:
+                os.fsync(f.fileno())
+
+    def clear(self):
+        self.save(None)
+
+    def load(self):
+        """Return the saved state, or None if idle, missing or unreadable"""
+        try:
+            with open(self.path, "rb") as f:
+                record = f.read(self.RECORD.size)
+        except OSError:
+            return None
+        if len(record) != self.RECORD.size:
+            return None
+        magic, version, length, start, last_seen, rate, currency, owner, project, crc = \
+            self.RECORD.unpack(record)
+        if magic != self.MAGIC or version != self.VERSION or zlib.crc32(record[:-4]) != crc:
+            return None
+        return {
+            'project': project[:length].decode("utf-8"),
+            'rate': rate,
+            'currency': currency.rstrip(b"\0").decode("utf-8"),
+            'start': start,
+            'last_seen': last_seen,
+            'owner': owner
+        }
+
+    def describes(self, state):
+        """True if the saved checkpoint is still the one for state's session"""
+        current = self.load()
+        return (current is not None and current['start'] == state['start']
+                and current['owner'] == state.get('owner', 0))
+
+    def held_elsewhere(self, state, now=None):
+        """True if state's session is being timed by another process that is still running"""
+        if state['owner'] in (0, os.getpid()) \
+                or (now or time.time()) - state['last_seen'] >= self.OWNER_TIMEOUT:
+            return False
+        if os.name == "posix":
+            # A crashed owner is known gone at once (on Windows os.kill would
+            # end the process, so only the timeout applies there)
+            try:
+                os.kill(state['owner'], 0)
+            except ProcessLookupError:
+                return False
+            except OSError:
+                pass
+        return True
+
+
+class ProjectIndex:
+    """Distinct projects, rates and currencies in a small JSON sidecar file
+
+    Read at startup to fill the dropdowns before the store is open, and the
+    only place projects and rates added with "+" are kept until their first
+    session. Also records when each project was last used, for ranking search
+    results. Every change re-reads the file first, so windows and CLI calls
+    add to it rather than overwrite each other.
+    """
+
+    def __init__(self, path=DEFAULT_INDEX_FILE):
+        self.path = path
+
+    def load(self):
+        """Return {'projects', 'rates', 'currencies', 'recent'}, empty if missing or unreadable"""
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            return {
+                'projects': [str(p) for p in data['projects']],
+                'rates': [float(r) for r in data['rates']],
+                'currencies': [str(c) for c in data['currencies']],
+                'recent': {str(p): float(t) for p, t in data.get('recent', {}).items()}
+            }
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            return {'projects': [], 'rates': [], 'currencies': [], 'recent': {}}
+
+    def add(self, projects=(), rates=(), currencies=(), used=()):
+        """Add values to the index, marking the projects in used as used now
+
+        Returns True if the file changed.
+        """
+        data = self.load()
+        recent = dict(data['recent'])
+        now = time.time()
+        for project in used:
+            recent[str(project)] = now
+        merged = {
+            'projects': sorted(set(data['projects']) | {str(p) for p in projects} | set(recent)),
+            'rates': sorted(set(data['rates']) | {float(r) for r in rates}),
+            'currencies': sorted(set(data['currencies']) | {str(c) for c in currencies}),
+            'recent': recent
+        }
+        if merged == data:
+            return False
+        # The index can always be rebuilt from the store, so no fsync here
+        temp_file = self.path + ".tmp"
+        with open(temp_file, "w", encoding="utf-8") as f:
+            json.dump(merged, f)
+        os.replace(temp_file, self.path)
+        return True
+
+    def add_record(self, record):
+        return self.add(rates=[record['Rate']], currencies=[record['Currency']],
+                        used=[record['Project']])
+
+    def add_totals(self, totals):
+        """Add everything in a TotalsCache, e.g. sessions stored by older versions"""
+        return self.add(totals.projects(), totals.rates(),
+                        {currency for _, _, currency in totals.by_key})
+
+
+class FileLock:
+    """Cross-process lock, held by exclusively creating a lock file"""
+
+    def __init__(self, path, timeout=10.0, stale_after=60.0):
+        self.path = path
+        self.timeout = timeout
+        self.stale_after = stale_after
+        self.fd = None
+
+    def __enter__(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                self.fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                return self
+            except FileExistsError:
+                try:
+                    # A process that died while holding the lock leaves it behind
+                    if time.time() - os.path.getmtime(self.path) > self.stale_after:
+                        os.remove(self.path)
+                        continue
+                except OSError:
+                    continue
+                if time.monotonic() > deadline:
+                    raise OSError(f"Timed out waiting for {self.path}")
+                time.sleep(0.01)
+
+    def __exit__(self, *exc_info):
+        os.close(self.fd)
+        os.remove(self.path)
+
+
+class WriteBehindQueue:
+    """Collects committed sessions and writes them to a store in batches
+
+    add() returns once the session is fsync'd to the pending journal; that is
+    the durable acknowledgment. The store receives all pending sessions in one
+    add_sessions call when max_pending are waiting, when the oldest has waited
+    max_delay seconds, or on flush(). The journal is shared safely by several
+    processes (the window and CLI calls) through a lock file.
+
+    Before each batch is written its id is journaled. A flush interrupted by
+    a crash is replayed under the same id, and stores that record batch ids
+    (SQLiteStore, ParquetStore) use it to avoid writing sessions twice. The
+    workbook stores (ExcelStore, MonthlyExcelStore) cannot record the id in
+    the same write as the sessions, so a flush interrupted after the store
+    write is replayed in full and its sessions appear twice.
+    """
+
+    def __init__(self, store, journal_file=DEFAULT_PENDING_FILE,
+                 max_pending=WRITE_BEHIND_MAX_PENDING, max_delay=WRITE_BEHIND_MAX_DELAY):
+        self.store = store
+        self.journal = SessionJournal(journal_file)
+        self.lock = FileLock(journal_file + ".lock")
+        self.max_pending = max_pending
+        self.max_delay = max_delay
+
+    def add(self, record):
+        """Durably queue a session, flushing if the batch is due"""
+        with self.lock:
+            self.journal.append({'queued': time.time(), 'record': record})
+        self.flush_if_due()
+
+    def add_session(self, record):
+        self.add(record)
+
+    def _pending(self):
+        """Journaled sessions not yet in the store, as [batch_id, records] groups
+
+        batch_id is None for sessions that have not been part of a flush yet.
+        """
+        groups = [[None, []]]
+        oldest = None
+        for entry in self.journal.read():
+            if 'batch' in entry:
+                if self._applied(entry['batch']):
+                    # Everything before a batch the store has applied is already stored
+                    groups = [[None, []]]
+                    oldest = None
+                else:
+                    # A flush that did not complete; replay it under the same id
+                    groups[-1][0] = entry['batch']
+                    groups.append([None, []])
+                continue
+            groups[-1][1].append(entry['record'])
+            if oldest is None:
+                oldest = entry['queued']
+        return [g for g in groups if g[1]], oldest
+
+    def _applied(self, batch_id):
+        has_batch = getattr(self.store, "has_batch", None)
+        return has_batch is not None and has_batch(batch_id)
+
+    def flush_if_due(self):
+        with self.lock:
+            groups, oldest = self._pending()
+            due = (sum(len(records) for _, records in groups) >= self.max_pending
+                   or (oldest is not None and time.time() - oldest >= self.max_delay))
+            return self._flush(groups) if due else 0
+
+    def flush(self):
+        """Write every pending session to the store now"""
+        with self.lock:
+            groups, _ = self._pending()
+            return self._flush(groups)
+
+    def _flush(self, groups):
+        count = 0
+        for batch_id, records in groups:
+            if batch_id is None:
+                batch_id = uuid.uuid4().hex
+                self.journal.append({'batch': batch_id})
+            self.store.add_sessions(records, batch_id)
+            count += len(records)
+        self.journal.truncate()
+        return count
+
+
+def atomic_write(path, write):
+    """Call write(f) on a temp file and rename it to path, so a crash never
+    leaves a half-written file in place of the old one"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_file = tempfile.mkstemp(suffix=os.path.splitext(path)[1], prefix=".tmp-", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp creates the file owner-only; keep the file's permissions
+        mode = os.stat(path).st_mode if os.path.exists(path) else 0o644
+        os.chmod(temp_file, mode & 0o777)
+        os.replace(temp_file, path)
+    except BaseException:
+        os.remove(temp_file)
+        raise
+    if hasattr(os, "O_DIRECTORY"):
+        # Make the rename itself durable (POSIX only)
+        dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+def atomic_write_excel(df, excel_file):
+    """Write df to excel_file atomically, see atomic_write"""
+    atomic_write(excel_file, lambda f: df.to_excel(f, index=False, engine="openpyxl"))
+
+
+def write_workbook(excel_file, chunks):
+    """Write chunks of records to excel_file atomically, one row at a time
+
+    Uses openpyxl's write-only mode, so memory stays flat however many
+    sessions there are. chunks may be read from excel_file itself.
+    """
+    openpyxl = load_openpyxl()
+
+    def write(f):
+        workbook = openpyxl.Workbook(write_only=True)
+        sheet = workbook.create_sheet("Sheet1")
+        sheet.append(COLUMNS)
+        for chunk in chunks:
+            for record in chunk:
+                row = [record[c] for c in COLUMNS]
+                row[1] = datetime_date(record['Date'])
+                sheet.append(row)
+        workbook.save(f)
+
+    atomic_write(excel_file, write)
+
+
+def empty_frame():
+    """Return an empty session DataFrame with explicit dtypes"""
+    pd = load_pandas()
+    return pd.DataFrame({
+        'Project': pd.Series(dtype='string'),
+        'Date': pd.Series(dtype='datetime64[ns]'),
+        'Start_Time': pd.Series(dtype='string'),
+        'End_Time': pd.Series(dtype='string'),
+        'Duration_Minutes': pd.Series(dtype='int64'),
+        'Rate': pd.Series(dtype='float64'),
+        'Currency': pd.Series(dtype='string'),
+        'Start_UTC': pd.Series(dtype='int64'),
+        'End_UTC': pd.Series(dtype='int64'),
+        'UTC_Offset': pd.Series(dtype='int64')
+    })
+
+
+def records_to_frame(records):
+    """Build a session DataFrame with the workbook column layout"""
+    pd = load_pandas()
+    df = pd.DataFrame(records, columns=COLUMNS)
+    df['Date'] = pd.to_datetime(df['Date'])
+    return df
+
+
+def iter_workbook(excel_file, chunk_size=WORKBOOK_CHUNK, strict=False):
+    """Yield the sessions of a workbook as lists of up to chunk_size records
+
+    The sheet XML is parsed as a stream (see iter_sheet_rows), so memory use
+    stays flat however large the workbook is, and neither pandas nor
+    openpyxl is needed. Rows with a value missing or unreadable are skipped,
+    or with strict raise ValueError, so an import never drops a session.
+    """
+    rows, date1904 = iter_sheet_rows(excel_file)
+    header = next(rows, None)
+    if header is None:
+        return
+    # Workbooks from before the epoch columns get them computed
+    positions = [header.index(c) if c in header else None for c in COLUMNS]
+    epoch = date(1904, 1, 1) if date1904 else date(1899, 12, 30)
+    chunk, skipped = [], 0
+    for row in rows:
+        values = [row[i] if i is not None and i < len(row) else None for i in positions]
+        if all(v is None for v in values):
+            # Blank or trailing row
+            continue
+        try:
+            if any(v is None for v in values[:7]):
+                raise ValueError("A value is missing.")
+            chunk.append(cell_record(values, epoch))
+        except (TypeError, ValueError):
+            if strict:
+                raise ValueError(f"{excel_file} has an incomplete or unreadable session: "
+                                 f"{', '.join('' if v is None else str(v) for v in values[:7])}."
+                                 " Complete or delete that row and try again.")
+            # Partly filled in by hand: leave it out rather than fail the load
+            skipped += 1
+            continue
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if skipped:
+        print(f"Info: Skipped {skipped} incomplete rows in {excel_file}")
+    if chunk:
+        yield chunk
+
+
+XLSX_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+XLSX_REL_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+SHARED_STRINGS = "xl/sharedStrings.xml"
+EMPTY_SHARED_STRINGS = (
+    b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    b'<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"'
+    b' count="0" uniqueCount="0"></sst>')
+SHARED_STRINGS_TYPE = (
+    b'<Override PartName="/xl/sharedStrings.xml" ContentType='
+    b'"application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>')
+SHARED_STRINGS_RELATION = (
+    b'<Relationship Id="rIdSharedStrings" Type='
+    b'"http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings"'
+    b' Target="sharedStrings.xml"/>')
+# Appended cells of these columns point into the shared string table, so
+# each project name and currency code is stored in the workbook only once
+SHARED_COLUMNS = ('Project', 'Currency')
+
+
+def workbook_layout(archive):
+    """Return (path of the first sheet, whether dates use the 1904 system)"""
+    with archive.open("xl/workbook.xml") as f:
+        workbook = ElementTree.parse(f).getroot()
+    properties = workbook.find(XLSX_NS + "workbookPr")
+    date1904 = properties is not None and properties.get("date1904") in ("1", "true")
+    sheet_id = workbook.find(f"{XLSX_NS}sheets/{XLSX_NS}sheet").get(XLSX_REL_NS + "id")
+    with archive.open("xl/_rels/workbook.xml.rels") as f:
+        for relation in ElementTree.parse(f).getroot():
+            if relation.get("Id") == sheet_id:
+                target = relation.get("Target")
+    sheet_path = target.lstrip("/") if target.startswith("/") else "xl/" + target
+    return sheet_path, date1904
+
+
+def workbook_header(excel_file):
+    """Return (first row of the first sheet or None, whether dates use the 1904 system)"""
+    rows, date1904 = iter_sheet_rows(excel_file)
+    header = next(rows, None)
+    rows.close()
+    return header, date1904
+
+
+def iter_sheet_rows(excel_file):
+    """Stream the first sheet of a workbook as lists of cell values
+
+    Returns (rows, date1904). Strings come back as str and every number,
+    including dates and times, as a float, since cell styles are not read.
+    Parsed rows are dropped from the XML tree as soon as they are yielded.
+    """
+    archive = zipfile.ZipFile(excel_file)
+    sheet_path, date1904 = workbook_layout(archive)
+
+    strings = shared_strings(archive)
+
+    def rows():
+        try:
+            with archive.open(sheet_path) as f:
+                sheet_data = None
+                for event, element in ElementTree.iterparse(f, events=("start", "end")):
+                    if event == "start":
+                        if element.tag == XLSX_NS + "sheetData":
+                            sheet_data = element
+                    elif element.tag == XLSX_NS + "row":
+                        yield sheet_row(element, strings)
+                        sheet_data.clear()
+        finally:
+            archive.close()
+
+    return rows(), date1904
+
+
+def shared_strings(archive):
+    """Texts of a workbook's shared string table, in index order"""
+    strings = []
+    if SHARED_STRINGS in archive.namelist():
+        with archive.open(SHARED_STRINGS) as f:
+            for _, element in ElementTree.iterparse(f):
+                if element.tag == XLSX_NS + "si":
+                    strings.append("".join(t.text or "" for t in element.iter(XLSX_NS + "t")))
+                    element.clear()
+    return strings
+
+
+def sheet_row(element, strings):
+    """Values of one <row> element, placed by their cell references"""
+    row = []
+    for cell in element:
+        reference = cell.get("r")
+        if reference:
+            column = 0
+            for char in reference:
+                if not char.isalpha():
+                    break
+                column = column * 26 + ord(char.upper()) - 64
+            row.extend([None] * (column - 1 - len(row)))
+        kind = cell.get("t")
+        value = cell.find(XLSX_NS + "v")
+        if kind == "inlineStr":
+            row.append("".join(t.text or "" for t in cell.iter(XLSX_NS + "t")))
+        elif value is None or value.text is None:
+            row.append(None)
+        elif kind == "s":
+            try:
+                row.append(strings[int(value.text)])
+            except (IndexError, ValueError):
+                row.append(value.text)
+        elif kind in ("str", "e", "d"):
+            # "d" is an ISO 8601 date and/or time
+            row.append(value.text)
+        elif kind == "b":
+            row.append(value.text == "1")
+        else:
+            try:
+                row.append(float(value.text))
+            except ValueError:
+                # Left for cell_record to reject, with the rest of the row
+                row.append(value.text)
+    return row
+
+
+def cell_record(values, epoch):
+    """Build a record from one row of sheet values, in COLUMNS order"""
+    project, day, start_time, end_time, minutes, rate, currency, start_utc, end_utc, offset = values
+    if isinstance(day, float):
+        day = (epoch + timedelta(days=int(day))).isoformat()
+    record = {
+        'Project': str(project),
+        'Date': str(day)[:10],
+        'Start_Time': cell_time(start_time),
+        'End_Time': cell_time(end_time),
+        'Duration_Minutes': int(minutes),
+        'Rate': float(rate),
+        'Currency': str(currency)
+    }
+    if start_utc is None or end_utc is None or offset is None:
+        start_utc, end_utc, offset = record_epochs(record)
+    record.update({'Start_UTC': int(start_utc), 'End_UTC': int(end_utc), 'UTC_Offset': int(offset)})
+    return record
+
+
+def cell_time(value):
+    """Time of day from a text cell, an ISO date-time or an Excel time (fraction of a day)"""
+    if isinstance(value, float):
+        seconds = int(round(value % 1 * 86400)) % 86400
+        return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+    value = str(value)
+    if "T" in value:
+        value = value.split("T", 1)[1][:8]
+    return value
+
+
+def append_workbook(excel_file, records):
+    """Add records to the end of a workbook's first sheet without rewriting it
+
+    The sheet XML is copied through unparsed, with the new rows inserted
+    before </sheetData> and the dimension extended; the other zip members
+    are copied as they are, apart from the shared string table. New cells
+    reuse the styles of the last row (so dates keep their date format).
+    Projects and currencies are written as shared strings, added to the table
+    if new (the table itself is added if the workbook has none, as openpyxl
+    writes inline strings), and other text as inline strings. Raises
+    ValueError if the sheet has no data row to copy styles from or an
+    unexpected layout.
+    """
+    header, date1904 = workbook_header(excel_file)
+    if header is None or any(c not in header for c in COLUMNS):
+        raise ValueError(f"{excel_file} does not have the session columns.")
+    # Cells must appear in column order within a row
+    columns = [(column_letter(header.index(c)), c) for c in sorted(COLUMNS, key=header.index)]
+    epoch = date(1904, 1, 1) if date1904 else date(1899, 12, 30)
+    # Shared string table: text -> index, its number of entries (a text can
+    # appear more than once, e.g. as rich-text variants) and the texts new to it
+    shared = {}
+    entries = 0
+    added_strings = []
+
+    def string_cell(ref, style, text):
+        if text not in shared:
+            shared[text] = entries + len(added_strings)
+            added_strings.append(text)
+        return f'<c r="{ref}"{style} t="s"><v>{shared[text]}</v></c>'
+
+    def new_rows(tail):
+        """XML for the new rows, numbered and styled after the last row in tail"""
+        # Attributes are read with regular expressions: the fragment may use
+        # namespace prefixes declared elsewhere in the sheet
+        start = tail.rfind(b"<row ")
+        number = re.match(rb'<row [^>]*?\br="(\d+)"', tail[start:]) if start >= 0 else None
+        if number is None:
+            raise ValueError("Cannot find the last row of the sheet.")
+        row_number = int(number.group(1))
+        if row_number < 2:
+            raise ValueError("The sheet has no data row to copy styles from.")
+        styles = {}
+        for cell in re.finditer(rb'<c ([^>]*?)/?>', tail[start:]):
+            ref = re.search(rb'\br="([A-Z]+)\d+"', cell.group(1))
+            style = re.search(rb'\bs="(\d+)"', cell.group(1))
+            if ref and style:
+                styles[ref.group(1).decode()] = f' s="{style.group(1).decode()}"'
+        date_letter = column_letter(header.index('Date'))
+        if date_letter not in styles:
+            raise ValueError("The last row has no date format to copy.")
+        parts = []
+        for record in records:
+            row_number += 1
+            cells = []
+            for letter, column in columns:
+                value = record[column]
+                ref = f'{letter}{row_number}'
+                style = styles.get(letter, "")
+                if column == 'Date':
+                    serial = (datetime_date(value) - epoch).days
+                    cells.append(f'<c r="{ref}"{style}><v>{serial}</v></c>')
+                elif column in ['Duration_Minutes', 'Rate'] + EPOCH_COLUMNS:
+                    cells.append(f'<c r="{ref}"{style}><v>{value!r}</v></c>')
+                elif column in SHARED_COLUMNS:
+                    cells.append(string_cell(ref, style, str(value)))
+                else:
+                    text = xml_escape(str(value))
+                    cells.append(f'<c r="{ref}"{style} t="inlineStr"><is>'
+                                 f'<t xml:space="preserve">{text}</t></is></c>')
+            parts.append(f'<row r="{row_number}">{"".join(cells)}</row>')
+        return "".join(parts).encode("utf-8")
+
+    def write(f):
+        nonlocal entries
+        try:
+            target = zipfile.ZipFile(f, "w", zipfile.ZIP_DEFLATED, compresslevel=SHEET_COMPRESSLEVEL)
+        except TypeError:
+            # Python 3.6 has no compresslevel
+            target = zipfile.ZipFile(f, "w", zipfile.ZIP_DEFLATED)
+        with zipfile.ZipFile(excel_file) as source, target:
+            sheet_path, _ = workbook_layout(source)
+            has_table = SHARED_STRINGS in source.namelist()
+            for text in shared_strings(source):
+                shared.setdefault(text, entries)
+                entries += 1
+            for info in source.infolist():
+                if info.filename == SHARED_STRINGS:
+                    # Written last, once the new rows have added their strings
+                    continue
+                if info.filename != sheet_path:
+                    data = source.read(info)
+                    if not has_table and info.filename == "[Content_Types].xml":
+                        data = insert_before_end(data, SHARED_STRINGS_TYPE)
+                    elif not has_table and info.filename == "xl/_rels/workbook.xml.rels":
+                        data = insert_before_end(data, SHARED_STRINGS_RELATION)
+                    target.writestr(info, data)
+                    continue
+                # Opened by name so the target's compression level applies
+                with source.open(info) as sheet, \
+                        target.open(info.filename, "w", force_zip64=info.file_size > 1 << 30) as out:
+                    patch_sheet(sheet, out, len(records), new_rows)
+            references = len(records) * len(SHARED_COLUMNS)
+            if has_table:
+                info = source.getinfo(SHARED_STRINGS)
+                target.writestr(info, patch_shared_strings(source.read(info), references, added_strings))
+            else:
+                target.writestr(SHARED_STRINGS, patch_shared_strings(
+                    EMPTY_SHARED_STRINGS, references, added_strings), zipfile.ZIP_DEFLATED)
+
+    atomic_write(excel_file, write)
+
+
+def patch_sheet(sheet, out, added, new_rows, chunk_size=1 << 20):
+    """Copy sheet XML from sheet to out, inserting new_rows(tail) before </sheetData>
+
+    tail is the end of the existing rows, for new_rows to number and style
+    the new ones; the dimension's last row is moved down by added rows.
+    """
+    end_tag = b"</sheetData>"
+    carry = b""
+    tail = b""
+    first = True
+    while True:
+        chunk = sheet.read(chunk_size)
+        if not chunk:
+            raise ValueError("The sheet has no </sheetData>.")
+        data = carry + chunk
+        if first:
+            first = False
+            data = re.sub(
+                rb'(<dimension ref="(?:[A-Z]+\d+:)?[A-Z]+)(\d+)"',
+                lambda m: m.group(1) + str(int(m.group(2)) + added).encode() + b'"',
+                data, count=1)
+        end = data.find(end_tag)
+        if end >= 0:
+            out.write(data[:end])
+            out.write(new_rows(tail + data[:end]))
+            out.write(data[end:])
+            break
+        # Keep enough back to find an end tag split over two reads
+        keep = len(end_tag) - 1
+        out.write(data[:-keep])
+        tail = (tail + data[:-keep])[-65536:]
+        carry = data[-keep:]
+    while True:
+        chunk = sheet.read(chunk_size)
+        if not chunk:
+            break
+        out.write(chunk)
+
+
+def patch_shared_strings(table, references, strings):
+    """Shared string table XML with strings appended and its counts raised
+
+    references is the number of new cells pointing into the table.
+    """
+    new = "".join(f'<si><t xml:space="preserve">{xml_escape(text)}</t></si>' for text in strings)
+    table = insert_before_end(table, new.encode("utf-8"))
+
+    def bump(name, added):
+        nonlocal table
+        table = re.sub(
+            rb'(<(?:\w+:)?sst\b[^>]*?\b' + name + rb'=")(\d+)"',
+            lambda m: m.group(1) + str(int(m.group(2)) + added).encode() + b'"',
+            table, count=1)
+
+    bump(b"count", references)
+    bump(b"uniqueCount", len(strings))
+    return table
+
+
+def insert_before_end(xml, fragment):
+    """XML document bytes with fragment added before the root's closing tag"""
+    end = xml.rfind(b"</")
+    if end < 0:
+        raise ValueError("Unexpected workbook part without a closing tag.")
+    return xml[:end] + fragment + xml[end:]
+
+
+def column_letter(index):
+    """Spreadsheet column letters for a 0-based column index"""
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def import_workbook(store, excel_file):
+    """Stream a workbook, and any sessions in its journal, into store
+
+    Raises ValueError, leaving the rest unread, at a row that cannot be read
+    as a session; skipping it would drop it from the history.
+    """
+    count = 0
+    for chunk in ExcelStore(excel_file).iter_records(strict=True):
+        store.add_sessions(chunk)
+        count += len(chunk)
+    return count
+
+
+def sort_columns(sort):
+    """Columns to order sessions by for a sort on one column, ties in time order"""
+    if sort not in COLUMNS:
+        raise ValueError(f"Cannot sort sessions by {sort}.")
+    if sort == 'Date':
+        # The start time orders sessions by date and time on its own
+        return ['Start_UTC']
+    return list(dict.fromkeys([sort, 'Start_UTC']))
+
+
+def filter_frame(df, project=None, date_from=None, date_to=None):
+    """Rows of a session DataFrame for a project and/or an inclusive ISO date range"""
+    pd = load_pandas()
+    low, high = day_bounds(date_from, date_to)
+    mask = pd.Series(True, index=df.index)
+    if project:
+        mask &= df['Project'] == project
+    if low is not None:
+        mask &= df['Start_UTC'] >= low
+    if high is not None:
+        mask &= df['Start_UTC'] < high
+    return df[mask]
+
+
+class ExcelStore:
+    """Sessions kept in an xlsx workbook, with new sessions journaled until close"""
+
+    def __init__(self, excel_file, journal_file=None):
+        self.excel_file = excel_file
+        if journal_file is None:
+            journal_file = os.path.splitext(excel_file)[0] + ".journal"
+        self.journal = SessionJournal(journal_file)
+
+        # Create Excel file if it doesn't exist. Workbooks from before the
+        # epoch columns are read as they are (see cell_record) and get the
+        # columns on the next flush, so opening one never rewrites it.
+        if not os.path.exists(self.excel_file):
+            atomic_write_excel(empty_frame(), self.excel_file)
+
+        # Compact copy of all sessions for browsing, see session_table
+        self._table = None
+        self._table_stamp = None
+
+    def stamp(self):
+        """Size and mtime of the workbook and size of the journal, to detect changes"""
+        stat = os.stat(self.excel_file)
+        journal_size = os.path.getsize(self.journal.path) if os.path.exists(self.journal.path) else 0
+        return [stat.st_size, stat.st_mtime_ns, journal_size]
+
+    def session_table(self):
+        """All sessions as a SessionTable, re-read only when the files changed"""
+        stamp = self.stamp()
+        if self._table is None or stamp != self._table_stamp:
+            table = SessionTable()
+            for chunk in self.iter_records():
+                table.extend(chunk)
+            self._table, self._table_stamp = table, stamp
+        return self._table
+
+    def sessions_frame(self):
+        """Read the workbook plus any sessions still waiting in the journal"""
+        return records_to_frame([record for chunk in self.iter_records() for record in chunk])
+
+    def iter_records(self, chunk_size=WORKBOOK_CHUNK, strict=False):
+        """Stream the workbook, then the journal, in chunks of records (see iter_workbook)"""
+        yield from iter_workbook(self.excel_file, chunk_size, strict)
+        pending = self.journal.read()
+        if pending:
+            yield pending
+
+    def projects(self):
+        return sorted({project for project, _, _, _ in self.totals()})
+
+    def rates(self):
+        return sorted({rate for _, rate, _, _ in self.totals()})
+
+    def project_minutes(self, project):
+        return self.session_table().project_minutes(project)
+
+    def totals(self):
+        """Return (project, rate, currency, minutes) for every combination
+
+        Aggregated from the cached session table, so projects, rates and
+        totals together read the workbook once.
+        """
+        return self.session_table().totals()
+
+    def sessions(self, project=None, date_from=None, date_to=None,
+                 sort='Date', descending=True, offset=0, limit=None):
+        """One page of sessions, filtered by project and date and sorted"""
+        return self.session_table().page(project, date_from, date_to, sort, descending, offset, limit)
+
+    def count_sessions(self, project=None, date_from=None, date_to=None):
+        return len(self.session_table().select(project, date_from, date_to))
+
+    def add_session(self, record):
+        # Append to the journal; the workbook is rewritten only on close
+        self.journal.append(record)
+
+    def add_sessions(self, records, batch_id=None):
+        self.journal.extend(records)
+
+    def flush(self):
+        """Fold journaled sessions into the workbook and clear the journal
+
+        The workbook is replaced before the journal is cleared; a crash
+        between the two leaves the sessions in both, and the next flush
+        appends them again.
+        """
+        pending = self.journal.read()
+        if not pending:
+            return 0
+        try:
+            # Appends rows to the sheet XML without touching existing ones
+            append_workbook(self.excel_file, pending)
+        except ValueError:
+            # No data row to take cell styles from (a new workbook), a
+            # workbook from before the epoch columns or an unexpected
+            # layout: stream the whole history into a new workbook instead
+            write_workbook(self.excel_file, self.iter_records())
+        self.journal.truncate()
+        return len(pending)
+
+    def export_excel(self, excel_file):
+        """Write the full history to a workbook for accounting"""
+        if os.path.abspath(excel_file) == os.path.abspath(self.excel_file):
+            self.flush()
+        else:
+            atomic_write_excel(self.sessions_frame(), excel_file)
+
+    def close(self):
+        self.flush()
+
+
+class SQLiteStore:
+    """Sessions kept in an indexed SQLite database
+
+    Project names and currency codes are stored once, in the projects and
+    currencies tables, and sessions refer to them by integer id. Start and
+    end are UTC epoch seconds with the local clock's UTC offset in minutes;
+    the session_records view derives Date, Start_Time and End_Time from them.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS projects (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
+        );
+        CREATE TABLE IF NOT EXISTS currencies (
+            id INTEGER PRIMARY KEY,
+            code TEXT NOT NULL UNIQUE
+        );
+        CREATE TABLE IF NOT EXISTS sessions (
+            id INTEGER PRIMARY KEY,
+            project_id INTEGER NOT NULL REFERENCES projects (id),
+            start_utc INTEGER NOT NULL,
+            end_utc INTEGER NOT NULL,
+            utc_offset INTEGER NOT NULL,
+            duration_minutes INTEGER NOT NULL,
+            rate REAL NOT NULL,
+            currency_id INTEGER NOT NULL REFERENCES currencies (id)
+        );
+        -- Covering index: per-project totals never touch the table rows
+        CREATE INDEX IF NOT EXISTS idx_sessions_project
+            ON sessions (project_id, duration_minutes);
+        -- Date ranges and history browsing: a project's sessions in time
+        -- order, and all sessions in time order
+        CREATE INDEX IF NOT EXISTS idx_sessions_project_start ON sessions (project_id, start_utc);
+        CREATE INDEX IF NOT EXISTS idx_sessions_start ON sessions (start_utc);
+        -- History sorted by any other column walks one of these in order,
+        -- ties in time order, see SORT_KEYS. Projects and currencies sort by
+        -- name through the unique indexes on their tables.
+        CREATE INDEX IF NOT EXISTS idx_sessions_duration_start
+            ON sessions (duration_minutes, start_utc);
+        CREATE INDEX IF NOT EXISTS idx_sessions_rate_start ON sessions (rate, start_utc);
+        CREATE INDEX IF NOT EXISTS idx_sessions_currency_start
+            ON sessions (currency_id, start_utc);
+        CREATE INDEX IF NOT EXISTS idx_sessions_start_time
+            ON sessions ((start_utc + utc_offset * 60) % 86400, start_utc);
+        CREATE INDEX IF NOT EXISTS idx_sessions_end_time
+            ON sessions ((end_utc + utc_offset * 60) % 86400, start_utc);
+        -- Sessions with their project name, currency code and local times
+        CREATE VIEW IF NOT EXISTS session_records AS
+            SELECT s.id, s.project_id, p.name AS project,
+                   date(s.start_utc + s.utc_offset * 60, 'unixepoch') AS date,
+                   time(s.start_utc + s.utc_offset * 60, 'unixepoch') AS start_time,
+                   time(s.end_utc + s.utc_offset * 60, 'unixepoch') AS end_time,
+                   s.duration_minutes, s.rate, c.code AS currency,
+                   s.start_utc, s.end_utc, s.utc_offset
+            FROM sessions s
+            JOIN projects p ON p.id = s.project_id
+            JOIN currencies c ON c.id = s.currency_id;
+        -- Write-behind batches already stored, see WriteBehindQueue
+        CREATE TABLE IF NOT EXISTS applied_batches (id TEXT PRIMARY KEY);
+        -- Workbooks exported to: last session id in them and their size and
+        -- mtime right after, see update_export
+        CREATE TABLE IF NOT EXISTS exports (
+            path TEXT PRIMARY KEY,
+            last_id INTEGER NOT NULL,
+            stamp TEXT NOT NULL
+        );
+    """
+
+    # What sessions are ordered by for each column: an indexed key that sorts
+    # the same way. Local times of day are seconds since local midnight.
+    SORT_KEYS = {
+        'Project': "p.name",
+        'Start_Time': "(s.start_utc + s.utc_offset * 60) % 86400",
+        'End_Time': "(s.end_utc + s.utc_offset * 60) % 86400",
+        'Duration_Minutes': "s.duration_minutes",
+        'Rate': "s.rate",
+        'Currency': "c.code",
+        'Start_UTC': "s.start_utc",
+        'End_UTC': "s.end_utc",
+        'UTC_Offset': "s.utc_offset",
+        'id': "s.id",
+    }
+
+    # Summary of minutes per project/rate/currency, kept current by a trigger.
+    # Startup reads this small table instead of aggregating the full history.
+    TOTALS_SCHEMA = """
+        CREATE TABLE session_totals (
+            project_id INTEGER NOT NULL,
+            rate REAL NOT NULL,
+            currency_id INTEGER NOT NULL,
+            minutes INTEGER NOT NULL,
+            PRIMARY KEY (project_id, rate, currency_id)
+        );
+        INSERT INTO session_totals
+            SELECT project_id, rate, currency_id, SUM(duration_minutes) FROM sessions
+            GROUP BY project_id, rate, currency_id;
+        CREATE TRIGGER session_totals_insert AFTER INSERT ON sessions
+        BEGIN
+            INSERT OR IGNORE INTO session_totals
+                VALUES (new.project_id, new.rate, new.currency_id, 0);
+            UPDATE session_totals SET minutes = minutes + new.duration_minutes
+                WHERE project_id = new.project_id AND rate = new.rate
+                    AND currency_id = new.currency_id;
+        END;
+    """
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.is_new = not os.path.exists(db_file)
+        self.conn = sqlite3.connect(db_file)
+        self.conn.executescript(self.SCHEMA)
+        if not self._has_table("session_totals"):
+            self.conn.executescript("BEGIN;" + self.TOTALS_SCHEMA + "COMMIT;")
+        self._load_ids()
+
+    def _has_table(self, name):
+        row = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone()
+        return row is not None
+
+    def _load_ids(self):
+        """Name -> id of the projects and currencies stored so far"""
+        self.project_ids = dict(self.conn.execute("SELECT name, id FROM projects"))
+        self.currency_ids = dict(self.conn.execute("SELECT code, id FROM currencies"))
+
+    def _name_id(self, table, column, ids, name):
+        """Id of a project name or currency code, added to its table if new"""
+        if name not in ids:
+            self.conn.execute(f"INSERT OR IGNORE INTO {table} ({column}) VALUES (?)", (name,))
+            ids[name] = self.conn.execute(
+                f"SELECT id FROM {table} WHERE {column} = ?", (name,)).fetchone()[0]
+        return ids[name]
+
+    def _project_id(self, project):
+        """Id of a known project, or None"""
+        if project not in self.project_ids:
+            # May have been added by another process sharing the database
+            row = self.conn.execute("SELECT id FROM projects WHERE name = ?", (project,)).fetchone()
+            if row is None:
+                return None
+            self.project_ids[project] = row[0]
+        return self.project_ids[project]
+
+    def projects(self):
+        rows = self.conn.execute(
+            "SELECT DISTINCT p.name FROM session_totals t JOIN projects p ON p.id = t.project_id"
+            " ORDER BY p.name")
+        return [r[0] for r in rows]
+
+    def rates(self):
+        rows = self.conn.execute("SELECT DISTINCT rate FROM session_totals ORDER BY rate")
+        return [r[0] for r in rows]
+
+    def project_minutes(self, project):
+        row = self.conn.execute(
+            "SELECT COALESCE(SUM(duration_minutes), 0) FROM sessions WHERE project_id = ?",
+            (self._project_id(project),)).fetchone()
+        return int(row[0])
+
+    def totals(self):
+        """Return (project, rate, currency, minutes) for every combination"""
+        rows = self.conn.execute(
+            "SELECT p.name, t.rate, c.code, t.minutes FROM session_totals t"
+            " JOIN projects p ON p.id = t.project_id JOIN currencies c ON c.id = t.currency_id")
+        return [(p, r, c, int(m)) for p, r, c, m in rows]
+
+    def _where(self, project, date_from, date_to):
+        clauses, params = [], []
+        if project:
+            # An unknown project has no id and matches nothing
+            clauses.append("project_id = ?")
+            params.append(self._project_id(project))
+        low, high = day_bounds(date_from, date_to)
+        if low is not None:
+            clauses.append("start_utc >= ?")
+            params.append(low)
+        if high is not None:
+            clauses.append("start_utc < ?")
+            params.append(high)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def sessions(self, project=None, date_from=None, date_to=None,
+                 sort='Date', descending=True, offset=0, limit=None):
+        """One page of sessions, filtered by project and date and sorted"""
+        where, params = self._where(project, date_from, date_to)
+        direction = " DESC" if descending else ""
+        order = ", ".join(self.SORT_KEYS[c] + direction for c in sort_columns(sort) + ['id'])
+        # Sorted by name, walk the names in order and each one's sessions in
+        # time order; CROSS JOIN keeps SQLite from reading sessions first and
+        # sorting them all. One project's sessions are few enough to sort.
+        if sort == 'Project' and not project:
+            tables = ("projects p CROSS JOIN sessions s ON s.project_id = p.id"
+                      " JOIN currencies c ON c.id = s.currency_id")
+        elif sort == 'Currency' and not project:
+            tables = ("currencies c CROSS JOIN sessions s ON s.currency_id = c.id"
+                      " JOIN projects p ON p.id = s.project_id")
+        else:
+            tables = ("sessions s JOIN projects p ON p.id = s.project_id"
+                      " JOIN currencies c ON c.id = s.currency_id")
+        rows = self.conn.execute(
+            "SELECT p.name, date(s.start_utc + s.utc_offset * 60, 'unixepoch'),"
+            " time(s.start_utc + s.utc_offset * 60, 'unixepoch'),"
+            " time(s.end_utc + s.utc_offset * 60, 'unixepoch'),"
+            " s.duration_minutes, s.rate, c.code, s.start_utc, s.end_utc, s.utc_offset"
+            f" FROM {tables}{where} ORDER BY {order} LIMIT ? OFFSET ?",
+            params + [-1 if limit is None else limit, offset])
+        return [dict(zip(COLUMNS, row)) for row in rows]
+
+    def count_sessions(self, project=None, date_from=None, date_to=None):
+        where, params = self._where(project, date_from, date_to)
+        return self.conn.execute(f"SELECT COUNT(*) FROM sessions{where}", params).fetchone()[0]
+
+    def add_session(self, record):
+        self.add_sessions([record])
+
+    def add_sessions(self, records, batch_id=None):
+        """Insert records in one transaction, remembering batch_id if given"""
+        try:
+            with self.conn:
+                rows = []
+                for r in map(with_epochs, records):
+                    rows.append((
+                        self._name_id("projects", "name", self.project_ids, r['Project']),
+                        r['Start_UTC'], r['End_UTC'], r['UTC_Offset'], r['Duration_Minutes'], r['Rate'],
+                        self._name_id("currencies", "code", self.currency_ids, r['Currency'])))
+                self.conn.executemany(
+                    "INSERT INTO sessions (project_id, start_utc, end_utc, utc_offset,"
+                    " duration_minutes, rate, currency_id) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+                if batch_id is not None:
+                    self.conn.execute("INSERT INTO applied_batches (id) VALUES (?)", (batch_id,))
+        except Exception:
+            # Names added in the rolled back transaction have no ids after all
+            self._load_ids()
+            raise
+
+    def has_batch(self, batch_id):
+        row = self.conn.execute("SELECT 1 FROM applied_batches WHERE id = ?", (batch_id,)).fetchone()
+        return row is not None
+
+    def sessions_frame(self):
+        pd = load_pandas()
+        df = pd.read_sql_query(
+            "SELECT project AS Project, date AS Date, start_time AS Start_Time,"
+            " end_time AS End_Time, duration_minutes AS Duration_Minutes,"
+            " rate AS Rate, currency AS Currency, start_utc AS Start_UTC,"
+            " end_utc AS End_UTC, utc_offset AS UTC_Offset FROM session_records ORDER BY id",
+            self.conn)
+        df['Date'] = pd.to_datetime(df['Date'])
+        return df
+
+    def import_excel(self, excel_file):
+        """Load every session of an existing workbook into the database"""
+        return import_workbook(self, excel_file)
+
+    def _record_chunks(self, after_id=0, chunk_size=WORKBOOK_CHUNK):
+        """Stream the sessions with ids above after_id, in id order, in chunks of records"""
+        cursor = self.conn.execute(
+            "SELECT project, date, start_time, end_time, duration_minutes, rate, currency,"
+            " start_utc, end_utc, utc_offset FROM session_records WHERE id > ? ORDER BY id",
+            (after_id,))
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield [dict(zip(COLUMNS, row)) for row in rows]
+
+    def _last_id(self):
+        return self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM sessions").fetchone()[0]
+
+    def _workbook_stamp(self, excel_file):
+        stat = os.stat(excel_file)
+        return json.dumps([stat.st_size, stat.st_mtime_ns])
+
+    def _exported(self, excel_file, last_id):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO exports (path, last_id, stamp) VALUES (?, ?, ?)",
+                              (os.path.abspath(excel_file), last_id, self._workbook_stamp(excel_file)))
+
+    def export_excel(self, excel_file):
+        """Write the full history to a workbook for accounting"""
+        last_id = self._last_id()
+        write_workbook(excel_file, self._record_chunks())
+        self._exported(excel_file, last_id)
+
+    def update_export(self, excel_file):
+        """Bring a workbook written by export_excel up to date, returning the sessions added
+
+        Only sessions stored since the last export are appended, and the
+        whole history is written only if the workbook is missing. A workbook
+        this database did not write, or that was changed since, is never
+        overwritten: ValueError is raised instead.
+        """
+        if not os.path.exists(excel_file):
+            self.export_excel(excel_file)
+            return self.count_sessions()
+        last_id = self._last_id()
+        row = self.conn.execute("SELECT last_id, stamp FROM exports WHERE path = ?",
+                                (os.path.abspath(excel_file),)).fetchone()
+        if row is None or row[1] != self._workbook_stamp(excel_file):
+            raise ValueError(f"{excel_file} was changed after the last export and is left as it is."
+                             " Move or rename it to export the sessions again.")
+        if row[0] == last_id:
+            return 0
+        records = [record for chunk in self._record_chunks(row[0]) for record in chunk]
+        try:
+            append_workbook(excel_file, records)
+        except ValueError:
+            # No data row to copy styles from: the export is unchanged since
+            # this database wrote it, so write it all again
+            self.export_excel(excel_file)
+            return self.count_sessions()
+        self._exported(excel_file, last_id)
+        return len(records)
+
+    def close(self):
+        self.conn.close()
+
+
+class MonthlyExcelStore:
+    """Sessions split into one workbook per month, with a manifest of totals
+
+    <root>/2026-10.xlsx holds the sessions of October 2026. manifest.json
+    keeps the project/rate/currency totals of every month, so totals and the
+    project and rate lists never open a workbook, and only the months that
+    received sessions (normally the current one) are rewritten on close.
+    Each month's entry carries the size and mtime of its files; a month whose
+    files changed behind the manifest's back is re-read on open.
+    """
+
+    MANIFEST = "manifest.json"
+
+    def __init__(self, root):
+        self.root = root
+        self.is_new = not os.path.exists(os.path.join(root, self.MANIFEST))
+        os.makedirs(root, exist_ok=True)
+        self.manifest_file = os.path.join(root, self.MANIFEST)
+        self.partitions = {}
+        # Combined table of all months for browsing, see session_table
+        self._table = None
+        self._table_stamps = None
+        self.months = {}
+        if not self.is_new:
+            with open(self.manifest_file, encoding="utf-8") as f:
+                manifest = json.load(f)
+            self.months = manifest['months']
+        self._refresh()
+
+    def _workbook(self, month):
+        return os.path.join(self.root, f"{month}.xlsx")
+
+    def _partition(self, month):
+        if month not in self.partitions:
+            self.partitions[month] = ExcelStore(self._workbook(month))
+        return self.partitions[month]
+
+    def _stamp(self, month):
+        """Sizes and mtime of a month's workbook and journal"""
+        return self._partition(month).stamp()
+
+    def _refresh(self):
+        """Bring the manifest in line with the workbooks on disk"""
+        on_disk = {name[:-5] for name in os.listdir(self.root)
+                   if len(name) == 12 and name.endswith(".xlsx") and name[4] == "-"}
+        changed = False
+        for month in set(self.months) - on_disk:
+            del self.months[month]
+            changed = True
+        for month in sorted(on_disk):
+            stamp = self._stamp(month)
+            entry = self.months.get(month)
+            if entry is None or entry['stamp'] != stamp:
+                # Only months edited outside TimeTracker are read here
+                self.months[month] = {'stamp': stamp,
+                                      'totals': [list(t) for t in self._partition(month).totals()]}
+                changed = True
+        if changed:
+            self._save_manifest()
+
+    def _save_manifest(self):
+        temp_file = self.manifest_file + ".tmp"
+        with open(temp_file, "w", encoding="utf-8") as f:
+            json.dump({'months': self.months}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file, self.manifest_file)
+
+    def totals(self, month=None):
+        """Return (project, rate, currency, minutes) for every combination
+
+        Limited to one month ("YYYY-MM") if given; read from the manifest only.
+        """
+        combined = {}
+        months = [month] if month else self.months
+        for name in months:
+            for project, rate, currency, minutes in self.months.get(name, {'totals': []})['totals']:
+                key = (project, float(rate), currency)
+                combined[key] = combined.get(key, 0) + minutes
+        return [key + (minutes,) for key, minutes in combined.items()]
+
+    def projects(self):
+        return sorted({project for project, _, _, _ in self.totals()})
+
+    def rates(self):
+        return sorted({rate for _, rate, _, _ in self.totals()})
+
+    def project_minutes(self, project):
+        return sum(minutes for p, _, _, minutes in self.totals() if p == project)
+
+    def session_table(self):
+        """All sessions as one SessionTable
+
+        Built from each month's cached table (see ExcelStore.session_table),
+        so only months whose files changed are read again.
+        """
+        stamps = [[month, self._stamp(month)] for month in sorted(self.months)]
+        if self._table is None or stamps != self._table_stamps:
+            self._table = SessionTable.concat(self._partition(month).session_table() for month, _ in stamps)
+            self._table_stamps = stamps
+        return self._table
+
+    def sessions(self, project=None, date_from=None, date_to=None,
+                 sort='Date', descending=True, offset=0, limit=None):
+        """One page of sessions, filtered by project and date and sorted"""
+        return self.session_table().page(project, date_from, date_to, sort, descending, offset, limit)
+
+    def count_sessions(self, project=None, date_from=None, date_to=None):
+        return len(self.session_table().select(project, date_from, date_to))
+
+    def add_session(self, record):
+        self.add_sessions([record])
+
+    def add_sessions(self, records, batch_id=None):
+        """Journal records into their months' workbooks and update the manifest
+
+        batch_id is ignored: the months' journals and the manifest are
+        separate files, so a batch cannot be marked applied atomically and a
+        write-behind replay after a crash adds its sessions again.
+        """
+        by_month = {}
+        for record in records:
+            by_month.setdefault(record['Date'][:7], []).append(record)
+        for month, month_records in sorted(by_month.items()):
+            self._partition(month).add_sessions(month_records)
+            entry = self.months.setdefault(month, {'totals': []})
+            totals = {(p, float(r), c): m for p, r, c, m in entry['totals']}
+            for record in month_records:
+                key = (record['Project'], float(record['Rate']), record['Currency'])
+                totals[key] = totals.get(key, 0) + record['Duration_Minutes']
+            entry['totals'] = [list(key) + [minutes] for key, minutes in totals.items()]
+            entry['stamp'] = self._stamp(month)
+        self._save_manifest()
+
+    def flush(self):
+        """Fold journaled sessions into the workbooks of the months that have any"""
+        count = 0
+        for month, partition in self.partitions.items():
+            count += partition.flush()
+            self.months[month]['stamp'] = self._stamp(month)
+        self._save_manifest()
+        return count
+
+    def sessions_frame(self):
+        pd = load_pandas()
+        frames = [self._partition(month).sessions_frame() for month in sorted(self.months)]
+        if not frames:
+            return empty_frame()
+        return pd.concat(frames, ignore_index=True)
+
+    def import_excel(self, excel_file):
+        """Split an existing workbook into monthly workbooks"""
+        count = import_workbook(self, excel_file)
+        self.flush()
+        return count
+
+    def export_excel(self, excel_file):
+        """Write the full history to a single workbook for accounting"""
+        atomic_write_excel(self.sessions_frame(), excel_file)
+
+    def close(self):
+        self.flush()
+
+
+class ParquetStore:
+    """Sessions kept as Parquet files partitioned by year and month
+
+    Layout: <root>/year=2026/month=10/part-<batch>.parquet. Each batch of
+    sessions adds one file per month it touches, written under a hidden temp
+    name and renamed into place; a marker in <root>/_batches records that the
+    batch is complete. Queries read only the columns they need.
+    """
+
+    # Compact a month once it holds more files than this
+    MAX_FILES_PER_PARTITION = 16
+
+    def __init__(self, root):
+        self.pa = load_pyarrow()
+        self.root = root
+        self.is_new = not os.path.exists(root)
+        os.makedirs(os.path.join(root, "_batches"), exist_ok=True)
+        self.schema = self.pa.schema([
+            ('Project', self.pa.string()),
+            ('Date', self.pa.date32()),
+            ('Start_Time', self.pa.string()),
+            ('End_Time', self.pa.string()),
+            ('Duration_Minutes', self.pa.int64()),
+            ('Rate', self.pa.float64()),
+            ('Currency', self.pa.string()),
+            ('Start_UTC', self.pa.int64()),
+            ('End_UTC', self.pa.int64()),
+            ('UTC_Offset', self.pa.int64())
+        ])
+        self._recover_compactions()
+
+    def _dataset(self):
+        return self.pa.dataset.dataset(self.root, schema=self.schema, format="parquet",
+                                       partitioning="hive", ignore_prefixes=[".", "_"])
+
+    def _read(self, columns, filter=None):
+        return self._dataset().to_table(columns=columns, filter=filter)
+
+    def _partitions(self):
+        """Directories of all year/month partitions"""
+        for year in sorted(os.listdir(self.root)):
+            if not year.startswith("year="):
+                continue
+            for month in sorted(os.listdir(os.path.join(self.root, year))):
+                if month.startswith("month="):
+                    yield os.path.join(self.root, year, month)
+
+    def projects(self):
+        column = self._read(['Project']).column('Project')
+        return sorted(self.pa.compute.unique(column).to_pylist())
+
+    def rates(self):
+        column = self._read(['Rate']).column('Rate')
+        return sorted(self.pa.compute.unique(column).to_pylist())
+
+    def project_minutes(self, project):
+        table = self._read(['Duration_Minutes'], self.pa.dataset.field('Project') == project)
+        total = self.pa.compute.sum(table.column('Duration_Minutes')).as_py()
+        return int(total or 0)
+
+    def totals(self):
+        """Return (project, rate, currency, minutes) for every combination"""
+        table = self._read(['Project', 'Rate', 'Currency', 'Duration_Minutes'])
+        grouped = table.group_by(['Project', 'Rate', 'Currency']).aggregate(
+            [('Duration_Minutes', 'sum')])
+        return list(zip(grouped.column('Project').to_pylist(),
+                        grouped.column('Rate').to_pylist(),
+                        grouped.column('Currency').to_pylist(),
+                        grouped.column('Duration_Minutes_sum').to_pylist()))
+
+    def _filter(self, project, date_from, date_to):
+        field = self.pa.dataset.field
+        low, high = day_bounds(date_from, date_to)
+        conditions = []
+        if project:
+            conditions.append(field('Project') == project)
+        if low is not None:
+            conditions.append(field('Start_UTC') >= low)
+        if high is not None:
+            conditions.append(field('Start_UTC') < high)
+        expression = None
+        for condition in conditions:
+            expression = condition if expression is None else expression & condition
+        return expression
+
+    def sessions(self, project=None, date_from=None, date_to=None,
+                 sort='Date', descending=True, offset=0, limit=None):
+        """One page of sessions, filtered by project and date and sorted"""
+        table = self._read(COLUMNS, self._filter(project, date_from, date_to))
+        order = "descending" if descending else "ascending"
+        table = table.sort_by([(c, order) for c in sort_columns(sort)])
+        records = table.slice(offset, limit).to_pylist()
+        for record in records:
+            record['Date'] = record['Date'].isoformat()
+        return records
+
+    def count_sessions(self, project=None, date_from=None, date_to=None):
+        return self._dataset().count_rows(filter=self._filter(project, date_from, date_to))
+
+    def add_session(self, record):
+        self.add_sessions([record])
+
+    def add_sessions(self, records, batch_id=None):
+        """Write records as one file per month; replaying a batch id is a no-op"""
+        if batch_id is None:
+            batch_id = uuid.uuid4().hex
+        by_month = {}
+        for record in records:
+            by_month.setdefault(record['Date'][:7], []).append(record)
+        for month, month_records in by_month.items():
+            directory = os.path.join(self.root, f"year={month[:4]}", f"month={int(month[5:7])}")
+            path = os.path.join(directory, f"part-{batch_id}.parquet")
+            if not os.path.exists(path):
+                os.makedirs(directory, exist_ok=True)
+                self._write(self._table(month_records), path)
+        open(os.path.join(self.root, "_batches", batch_id), "w").close()
+
+    def has_batch(self, batch_id):
+        return os.path.exists(os.path.join(self.root, "_batches", batch_id))
+
+    def _table(self, records):
+        records = [with_epochs(r) for r in records]
+        columns = {c: [r[c] for r in records] for c in COLUMNS}
+        columns['Date'] = [datetime_date(d) for d in columns['Date']]
+        return self.pa.table(columns, schema=self.schema)
+
+    def _write(self, table, path):
+        """Write a Parquet file under a hidden name and rename it into place"""
+        temp_file = os.path.join(os.path.dirname(path), ".tmp-" + os.path.basename(path))
+        self.pa.parquet.write_table(table, temp_file)
+        with open(temp_file, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(temp_file, path)
+
+    def compact(self, max_files=MAX_FILES_PER_PARTITION):
+        """Merge the files of months that have accumulated too many"""
+        for directory in self._partitions():
+            parts = sorted(f for f in os.listdir(directory) if f.startswith("part-"))
+            if len(parts) <= max_files:
+                continue
+            merged = f"part-merged-{uuid.uuid4().hex}.parquet"
+            table = self.pa.concat_tables(
+                [self.pa.parquet.read_table(os.path.join(directory, f), schema=self.schema)
+                 for f in parts])
+            # The intent file lets a crash between rename and cleanup be repaired
+            intent = os.path.join(directory, "_compaction")
+            with open(intent, "w", encoding="utf-8") as f:
+                json.dump({'merged': merged, 'parts': parts}, f)
+                f.flush()
+                os.fsync(f.fileno())
+            self._write(table, os.path.join(directory, merged))
+            self._finish_compaction(directory)
+
+    def _finish_compaction(self, directory):
+        intent = os.path.join(directory, "_compaction")
+        with open(intent, encoding="utf-8") as f:
+            plan = json.load(f)
+        if os.path.exists(os.path.join(directory, plan['merged'])):
+            # Merged file is in place: the originals are now duplicates
+            for part in plan['parts']:
+                if os.path.exists(os.path.join(directory, part)):
+                    os.remove(os.path.join(directory, part))
+        temp_file = os.path.join(directory, ".tmp-" + plan['merged'])
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        os.remove(intent)
+
+    def _recover_compactions(self):
+        for directory in self._partitions():
+            if os.path.exists(os.path.join(directory, "_compaction")):
+                self._finish_compaction(directory)
+
+    def sessions_frame(self):
+        pd = load_pandas()
+        df = self._read(COLUMNS).to_pandas()
+        df['Date'] = pd.to_datetime(df['Date'])
+        return df
+
+    def import_excel(self, excel_file):
+        """Load every session of an existing workbook into the store"""
+        return import_workbook(self, excel_file)
+
+    def export_excel(self, excel_file):
+        """Write the full history to a workbook for accounting"""
+        atomic_write_excel(self.sessions_frame(), excel_file)
+
+    def close(self):
+        self.compact()
+
+
+def datetime_date(text):
+    """Parse a record's ISO date"""
+    return datetime.strptime(text, "%Y-%m-%d").date()
+
+
+class TotalsCache:
+    """Running minute totals per project and per project/rate/currency"""
+
+    def __init__(self):
+        self.by_project = {}
+        self.by_key = {}
+
+    def load(self, store):
+        """Build the cache with a single aggregate query over the store"""
+        self.by_project.clear()
+        self.by_key.clear()
+        for project, rate, currency, minutes in store.totals():
+            self._add(project, rate, currency, minutes)
+
+    def _add(self, project, rate, currency, minutes):
+        self.by_project[project] = self.by_project.get(project, 0) + minutes
+        key = (project, float(rate), currency)
+        self.by_key[key] = self.by_key.get(key, 0) + minutes
+
+    def add(self, record):
+        """Account for a newly committed session"""
+        self._add(record['Project'], record['Rate'], record['Currency'],
+                  record['Duration_Minutes'])
+
+    def projects(self):
+        return sorted(self.by_project)
+
+    def rates(self):
+        return sorted({rate for _, rate, _ in self.by_key})
+
+    def project_minutes(self, project):
+        return self.by_project.get(project, 0)
+
+    def minutes(self, project, rate, currency):
+        return self.by_key.get((project, float(rate), currency), 0)
+
+
+def refresh_export(store, excel_file, changed=True):
+    """Keep excel_file an up-to-date export of store, for accounting
+
+    A SQLiteStore appends just the sessions stored since the last export,
+    and raises ValueError rather than overwrite a workbook edited since.
+    Other stores are written out again when changed (sessions were stored)
+    or the workbook is missing; an ExcelStore is its own workbook.
+    """
+    if isinstance(store, ExcelStore):
+        return
+    if hasattr(store, "update_export"):
+        store.update_export(excel_file)
+    elif changed or not os.path.exists(excel_file):
+        store.export_excel(excel_file)
+
+
+def open_store(data_file=DEFAULT_DATA_FILE, excel_file=DEFAULT_EXCEL_FILE):
+    """Open the store for data_file, migrating an existing workbook on first run"""
+    if data_file.lower().endswith(".xlsx"):
+        return ExcelStore(data_file)
+    if data_file.lower().endswith(".parquet"):
+        store = ParquetStore(data_file)
+    elif data_file.endswith(("/", os.sep)) or os.path.isdir(data_file):
+        store = MonthlyExcelStore(data_file)
+    else:
+        store = SQLiteStore(data_file)
+    if store.is_new and os.path.exists(excel_file):
+        try:
+            count = store.import_excel(excel_file)
+        except Exception:
+            # Leave no half-migrated store behind so the next run retries
+            store.close()
+            if os.path.isdir(data_file):
+                shutil.rmtree(data_file)
+            else:
+                os.remove(data_file)
+            raise
+        # The original is kept as it is; excel_file becomes an export of the
+        # store, written when it is closed
+        backup_file = keep_original(excel_file)
+        print(f"Info: Imported {count} sessions from {excel_file}, kept as {backup_file}")
+    return store
+
+
+def keep_original(path):
+    """Rename path to <name>.bak.<ext> (numbered if taken) and return the new name"""
+    base, ext = os.path.splitext(path)
+    backup_file = f"{base}.bak{ext}"
+    number = 1
+    while os.path.exists(backup_file):
+        number += 1
+        backup_file = f"{base}.bak{number}{ext}"
+    os.rename(path, backup_file)
+    return backup_file